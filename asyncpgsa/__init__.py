@@ -1,9 +1,30 @@
-from .pool import create_pool
-from .pgsingleton import PG
-from .connection import compile_query
+from importlib import import_module
+
 from .version import __version__
 
-pg = PG()
+# imported on first access, so `import asyncpgsa` does not pay for
+# sqlalchemy and asyncpg until they are used
+_LAZY = {
+    'create_pool': '.pool',
+    'PG': '.pgsingleton',
+    'compile_query': '.connection',
+}
+
+
+def __getattr__(name):
+    if name == 'pg':
+        value = __getattr__('PG')()
+    elif name in _LAZY:
+        value = getattr(import_module(_LAZY[name], __name__), name)
+    else:
+        raise AttributeError('module {!r} has no attribute {!r}'.format(
+            __name__, name))
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
 
 
 __all__ = [
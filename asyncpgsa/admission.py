@@ -0,0 +1,164 @@
+"""
+priority lanes and load shedding for pool acquisition
+"""
+
+import asyncio
+from collections import deque
+from time import monotonic
+
+from .metrics import DEFAULT_BUCKETS, Histogram
+
+
+class PoolOverloadedError(Exception):
+    """
+    raised instead of queueing when a lane's queue is full
+    """
+
+
+class Lane:
+    """
+    one class of callers sharing the pool, e.g. interactive or batch
+    """
+
+    __slots__ = ('name', 'reserved', 'max_queue', 'in_use', 'waiters',
+                 'wait', 'admitted', 'rejected', 'timeouts')
+
+    def __init__(self, name, *, reserved=0, max_queue=None,
+                 buckets=DEFAULT_BUCKETS):
+        """
+        :param str name: the priority callers pass to acquire
+        :param int reserved: connections only this lane may use
+        :param int max_queue: callers allowed to wait before new ones
+                              get `PoolOverloadedError`, None for no limit
+        """
+        self.name = name
+        self.reserved = reserved
+        self.max_queue = max_queue
+        self.in_use = 0
+        self.waiters = deque()
+        self.wait = Histogram(buckets)
+        self.admitted = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    @property
+    def unused_reservation(self):
+        return max(self.reserved - self.in_use, 0)
+
+    def snapshot(self):
+        return {
+            'name': self.name,
+            'reserved': self.reserved,
+            'in_use': self.in_use,
+            'queued': len(self.waiters),
+            'wait': self.wait.snapshot(),
+            'admitted': self.admitted,
+            'rejected': self.rejected,
+            'timeouts': self.timeouts,
+        }
+
+
+class AdmissionControl:
+    """
+    Decides which caller gets the next pool connection. `lanes` are
+    ordered from the highest priority to the lowest, when a connection
+    frees up the first lane with waiters that may use it gets it.
+    A lane may not use connections reserved for other lanes which those
+    lanes are not using.
+
+    pool = await create_pool(..., admission=AdmissionControl([
+        Lane('interactive', reserved=2),
+        Lane('batch', max_queue=100),
+    ]))
+    async with pool.transaction(priority='batch') as conn:
+        ...
+    """
+
+    __slots__ = ('pool', 'lanes', 'default', '_order')
+
+    def __init__(self, lanes, default=None):
+        """
+        :param lanes: `Lane`s, highest priority first
+        :param str default: lane for callers without a priority,
+                            defaults to the lowest priority lane
+        """
+        self.pool = None
+        self._order = list(lanes)
+        self.lanes = {lane.name: lane for lane in self._order}
+        self.default = default or self._order[-1].name
+
+    @property
+    def capacity(self):
+        autoscaler = getattr(self.pool, 'autoscaler', None)
+        if autoscaler is not None:
+            return autoscaler.target_size
+        return self.pool.get_max_size()
+
+    def lane(self, priority):
+        try:
+            return self.lanes[priority or self.default]
+        except KeyError:
+            raise ValueError('unknown priority {!r}'.format(priority))
+
+    def _admissible(self, lane):
+        in_use = 0
+        held_back = 0
+        for other in self._order:
+            in_use += other.in_use
+            if other is not lane:
+                held_back += other.unused_reservation
+        return in_use + held_back < self.capacity
+
+    async def admit(self, priority, timeout=None):
+        """
+        wait until `priority` may take a connection
+        :return: the `Lane`, pass it to `release` afterwards
+        :raises PoolOverloadedError: if the lane's queue is full
+        """
+        lane = self.lane(priority)
+        start = monotonic()
+        if not lane.waiters and self._admissible(lane):
+            lane.in_use += 1
+        else:
+            if lane.max_queue is not None \
+                    and len(lane.waiters) >= lane.max_queue:
+                lane.rejected += 1
+                raise PoolOverloadedError(
+                    '{} callers are already waiting in lane {!r}'.format(
+                        len(lane.waiters), lane.name))
+            waiter = asyncio.get_event_loop().create_future()
+            lane.waiters.append(waiter)
+            try:
+                await asyncio.wait_for(waiter, timeout)
+            except BaseException as e:
+                if waiter.done() and not waiter.cancelled():
+                    # granted just as we gave up, hand the slot on
+                    self.release(lane)
+                elif waiter in lane.waiters:
+                    lane.waiters.remove(waiter)
+                    # callers queued behind us may be admissible now
+                    self.wake()
+                if isinstance(e, asyncio.TimeoutError):
+                    lane.timeouts += 1
+                raise
+        lane.admitted += 1
+        lane.wait.observe(monotonic() - start)
+        return lane
+
+    def release(self, lane):
+        lane.in_use -= 1
+        self.wake()
+
+    def wake(self):
+        """
+        hand free capacity to waiters, highest priority first
+        """
+        for lane in self._order:
+            while lane.waiters and self._admissible(lane):
+                waiter = lane.waiters.popleft()
+                if not waiter.done():
+                    lane.in_use += 1
+                    waiter.set_result(None)
+
+    def snapshot(self):
+        return [lane.snapshot() for lane in self._order]
@@ -0,0 +1,174 @@
+"""
+resizing a pool from its acquire latency and utilization
+"""
+
+import asyncio
+import time
+
+from asyncpg.exceptions import PostgresError
+
+from .log import pool_logger
+from .maintenance import IdleSlots
+
+
+HEADROOM_QUERY = """
+SELECT current_setting('max_connections')::int
+     - current_setting('superuser_reserved_connections')::int
+     - (SELECT count(*) FROM pg_stat_activity)
+"""
+
+
+class PoolAutoscaler:
+    """
+    Every `interval` seconds looks at the acquire wait quantile and the
+    share of time connections were held, and moves the pool's target
+    size between min_size and max_size:
+
+    - grows by `step` when the wait quantile is above `max_wait` or
+      utilization above `high_utilization`, for `grow_after` intervals
+      in a row, and the server has more than `min_headroom` free
+      connection slots
+    - shrinks by `step` when utilization is below `low_utilization` and
+      nobody waited longer than `max_wait`, for `shrink_after` intervals
+
+    Capacity above the target is parked: those pool slots are taken out
+    of the acquire queue and their connections are closed.
+    """
+
+    __slots__ = ('pool', 'interval', 'max_wait', 'quantile',
+                 'high_utilization', 'low_utilization', 'grow_after',
+                 'shrink_after', 'step', 'min_headroom', 'headroom',
+                 'parked', '_task', '_last', '_last_time', '_streak')
+
+    def __init__(self, interval=5.0, *, max_wait=0.01, quantile=0.95,
+                 high_utilization=0.8, low_utilization=0.3, grow_after=1,
+                 shrink_after=3, step=1, min_headroom=5):
+        """
+        :param float interval: seconds between decisions
+        :param float max_wait: acquire wait in seconds that is too long
+        :param float quantile: quantile of acquire waits compared to
+                               max_wait
+        :param float high_utilization: held share of the target size
+                                       above which the pool grows
+        :param float low_utilization: held share below which it shrinks
+        :param int grow_after: intervals in a row before growing
+        :param int shrink_after: intervals in a row before shrinking
+        :param int step: connections added or removed at once
+        :param int min_headroom: free server connection slots to leave
+        """
+        self.pool = None
+        self.interval = interval
+        self.max_wait = max_wait
+        self.quantile = quantile
+        self.high_utilization = high_utilization
+        self.low_utilization = low_utilization
+        self.grow_after = grow_after
+        self.shrink_after = shrink_after
+        self.step = step
+        self.min_headroom = min_headroom
+        self.headroom = None
+        self.parked = []
+        self._task = None
+        self._last = None
+        self._last_time = None
+        self._streak = 0
+
+    @property
+    def target_size(self):
+        return self.pool.get_max_size() - len(self.parked)
+
+    def start(self):
+        if self._task is None:
+            self._mark()
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.resize(self.pool.get_max_size())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.tick()
+            except Exception:
+                pool_logger.exception('pool autoscaler failed')
+
+    def _mark(self):
+        metrics = self.pool.metrics
+        self._last = (metrics.acquire_wait.snapshot(),
+                      metrics.hold_time.snapshot())
+        self._last_time = time.monotonic()
+
+    async def tick(self):
+        """
+        look at the last interval and resize if needed
+        :return: the target size
+        """
+        metrics = self.pool.metrics
+        wait_then, hold_then = self._last
+        elapsed = time.monotonic() - self._last_time
+        wait = metrics.acquire_wait.since(wait_then).quantile(self.quantile)
+        held = metrics.hold_time.since(hold_then).sum
+        self._mark()
+
+        target = self.target_size
+        utilization = held / (elapsed * target) if elapsed and target else 0
+        if self.pool.get_idle_size():
+            await self._refresh_headroom()
+
+        if wait > self.max_wait or utilization > self.high_utilization \
+                or metrics.waiters:
+            self._streak = max(self._streak, 0) + 1
+            if self._streak >= self.grow_after and self._may_grow():
+                self._streak = 0
+                await self.resize(target + self.step)
+        elif utilization < self.low_utilization:
+            self._streak = min(self._streak, 0) - 1
+            if -self._streak >= self.shrink_after:
+                self._streak = 0
+                await self.resize(target - self.step)
+        else:
+            self._streak = 0
+        return self.target_size
+
+    def _may_grow(self):
+        return self.headroom is None or self.headroom > self.min_headroom
+
+    async def _refresh_headroom(self):
+        try:
+            async with self.pool.acquire(timeout=self.interval) as con:
+                self.headroom = await con.fetchval(HEADROOM_QUERY)
+        except (asyncio.TimeoutError, OSError, PostgresError) as e:
+            pool_logger.warning('could not read server headroom: %s', e)
+
+    async def resize(self, size):
+        """
+        move the target size towards `size`, within min_size and max_size.
+        Only idle slots can be parked, the rest follow on later ticks.
+        """
+        pool = self.pool
+        size = max(pool.get_min_size(), 1, min(size, pool.get_max_size()))
+        slots = IdleSlots(pool)
+        while self.target_size < size:
+            slots.put(self.parked.pop())
+        admission = getattr(pool, 'admission', None)
+        if admission is not None:
+            admission.wake()
+        while self.target_size > size:
+            # disconnected slots first, they cost nothing to park
+            holder = slots.take(lambda h: not h.is_connected()) or \
+                slots.take(lambda h: True)
+            if holder is None:
+                break
+            self.parked.append(holder)
+            await holder.close()
+        if size != self.target_size:
+            pool_logger.debug('pool target size %d, wanted %d',
+                              self.target_size, size)
@@ -0,0 +1,113 @@
+"""
+which sqlalchemy bind processors to run before asyncpg encodes a value.
+
+Many processors only convert values into something asyncpg's binary
+codecs accept anyway, so they are dropped; the decision is made once per
+statement shape and most statements then pass their parameters through.
+"""
+
+from collections import OrderedDict
+from threading import Lock
+
+from sqlalchemy import types
+from sqlalchemy.dialects import postgresql
+
+from .jsoncodecs import passthrough
+
+
+def keep(type_, dialect, processor):
+    return processor
+
+
+def drop(type_, dialect, processor):
+    return None
+
+
+def _array(type_, dialect, processor):
+    # asyncpg encodes lists, the processor only matters for its items
+    item = type_.item_type.dialect_impl(dialect)
+    return processor if item.bind_processor(dialect) else None
+
+
+def _enum(type_, dialect, processor):
+    # enum classes are turned into their names, plain strings go as is
+    if type_.enum_class is not None or type_.validate_strings:
+        return processor
+    return None
+
+
+def _json(type_, dialect, processor):
+    # with json_codecs asyncpg serializes, the processor is a no-op
+    if dialect._json_serializer is passthrough:
+        return None
+    return processor
+
+
+#: type class -> policy(type, dialect, processor) returning the processor
+#: to use (possibly a replacement) or None to pass values through. The
+#: most specific class of a parameter's type wins, types not listed keep
+#: their processor. Add entries before the first statement is compiled.
+BIND_PROCESSOR_POLICY = {
+    types.TypeDecorator: keep,
+    types.DateTime: drop,
+    types.Date: drop,
+    types.Time: drop,
+    types.Interval: drop,
+    types.Float: drop,
+    postgresql.UUID: drop,
+    types.ARRAY: _array,
+    types.Enum: _enum,
+    types.JSON: _json,
+}
+
+_plans = OrderedDict()
+# statements are also compiled in executor threads, see CompileOffloader
+_plans_lock = Lock()
+MAX_PLANS = 1000
+
+
+def bind_processors(compiled, keys, dialect, sql):
+    """
+    :param compiled: the compiled statement
+    :param keys: bind names in parameter order
+    :param sql: the compiled sql, part of the cache key
+    :return: a processor or None for each key, or None if there are no
+             processors left at all
+    """
+    binds = compiled.binds
+    # type instances, not classes: processors depend on their settings,
+    # like an Enum's class or an ARRAY's item type
+    key = (sql, dialect, tuple(binds[k].type for k in keys))
+    with _plans_lock:
+        try:
+            return _plans[key]
+        except KeyError:
+            pass
+    plan = _plan(compiled, keys, dialect)
+    with _plans_lock:
+        _plans[key] = plan
+        if len(_plans) > MAX_PLANS:
+            _plans.popitem(last=False)
+    return plan
+
+
+def _plan(compiled, keys, dialect):
+    processors = compiled._bind_processors
+    plan = []
+    for key in keys:
+        processor = processors.get(key)
+        if processor is not None:
+            type_ = compiled.binds[key].type
+            processor = _policy(type_)(type_, dialect, processor)
+        plan.append(processor)
+    if not any(plan):
+        return None
+    return tuple(plan)
+
+
+def _policy(type_):
+    for cls in type(type_).__mro__:
+        policy = BIND_PROCESSOR_POLICY.get(cls)
+        if policy is not None:
+            return policy
+    return keep
@@ -0,0 +1,118 @@
+"""
+detection of event loop stalls caused by synchronous work in asyncpgsa
+"""
+
+from collections import OrderedDict, deque
+from threading import Lock
+from time import perf_counter
+
+from .log import blocking_logger
+from .tracing import Hook, add_hook, remove_hook
+
+
+# spans that never await, so their wall time blocks the event loop.
+# asyncpgsa.bind runs inside asyncpgsa.compile, which already covers it
+BLOCKING_SPANS = frozenset(('asyncpgsa.compile', 'asyncpgsa.process_rows'))
+
+
+class BlockingEvent:
+    __slots__ = ('step', 'statement', 'duration')
+
+    def __init__(self, step, statement, duration):
+        self.step = step
+        self.statement = statement
+        self.duration = duration
+
+    def __repr__(self):
+        return '<BlockingEvent {} {:.3f}s {!r}>'.format(
+            self.step, self.duration, self.statement)
+
+
+class LoopBlockMonitor(Hook):
+    """
+    Measures the wall time of every compile and of preparing rows for
+    a `BufferedWriter` flush. Fetched records are decoded by asyncpg's
+    protocol as the data arrives, where no span can time them apart
+    from the network wait.
+    Steps that take at least `threshold` seconds blocked the event loop for
+    that long, unless they ran off the loop (see `tracing.off_loop`);
+    they are logged to `asyncpgsa.blocking`, kept in `events`,
+    and summed up per statement in `report()`, which shows the statements
+    worth caching or compiling off the loop.
+
+    monitor = LoopBlockMonitor(threshold=0.005).install()
+    """
+
+    __slots__ = ('threshold', 'max_statements', 'events', '_totals', '_lock')
+
+    def __init__(self, threshold=0.01, max_events=100, max_statements=1000):
+        """
+        :param float threshold: seconds a step must take to be reported
+        :param int max_events: most recent events kept in `events`
+        :param int max_statements: statements summed up in `report()`,
+                                   the least recently blocking are dropped
+        """
+        self.threshold = threshold
+        self.max_statements = max_statements
+        self.events = deque(maxlen=max_events)
+        self._totals = OrderedDict()
+        # steps may end in executor threads, see `CompileOffloader`
+        self._lock = Lock()
+
+    def install(self):
+        add_hook(self)
+        return self
+
+    def uninstall(self):
+        remove_hook(self)
+
+    def start(self, name, attributes):
+        if name in BLOCKING_SPANS and \
+                not attributes.get('asyncpgsa.off_loop'):
+            return name, perf_counter()
+        return None
+
+    def end(self, state, attributes, error):
+        if state is None:
+            return
+        step, start = state
+        duration = perf_counter() - start
+        if duration < self.threshold:
+            return
+
+        statement = attributes.get('db.statement')
+        event = BlockingEvent(step, statement, duration)
+        key = (step, statement)
+        with self._lock:
+            self.events.append(event)
+            total = self._totals.get(key)
+            if total is None:
+                total = self._totals[key] = [0, 0.0, 0.0]
+                if len(self._totals) > self.max_statements:
+                    self._totals.popitem(last=False)
+            else:
+                self._totals.move_to_end(key)
+            total[0] += 1
+            total[1] += duration
+            total[2] = max(total[2], duration)
+        blocking_logger.warning('%s blocked the event loop for %.3fs: %s',
+                                step, duration, statement)
+
+    def report(self):
+        """
+        :return: list of dicts per step and statement,
+                 most total blocking time first
+        """
+        with self._lock:
+            totals = [(key, tuple(total))
+                      for key, total in self._totals.items()]
+        return sorted((
+            {'step': step, 'statement': statement, 'count': count,
+             'total_time': total, 'max_time': max_time}
+            for (step, statement), (count, total, max_time) in totals),
+            key=lambda r: r['total_time'], reverse=True)
+
+    def reset(self):
+        with self._lock:
+            self.events.clear()
+            self._totals.clear()
@@ -0,0 +1,214 @@
+"""
+write-behind buffer for inserts
+"""
+
+import asyncio
+
+from .connection import default_dialect
+from .log import query_logger
+from .tracing import span
+
+
+class BufferFullError(Exception):
+    pass
+
+
+class BufferedWriter:
+    """
+    Accepts rows for `table` without waiting on the database, and inserts
+    them in bulk once `max_rows` rows are buffered or the oldest buffered
+    row is `max_delay` seconds old.
+
+    Rows are sent with binary COPY, or with executemany if `use_copy` is
+    False. Python side column defaults and bind processors are applied,
+    columns missing from a row get their server side default.
+
+    A failed flush keeps its rows and is retried after `max_delay`, by
+    the next `flush` or by `close`. The error is raised by the next call
+    to `write`/`flush`. If the flush in `close` fails the writer stays
+    open with the rows buffered, so `close` can be called again.
+
+    async with pg.buffered_writer(events) as writer:
+        for event in events:
+            await writer.write(event)
+    """
+
+    __slots__ = ('pool', 'table', 'max_rows', 'max_delay', 'max_buffer',
+                 'use_copy', 'timeout', '_dialect', '_rows', '_processors',
+                 '_timer', '_flushing', '_lock', '_space', '_error',
+                 '_closed')
+
+    def __init__(self, pool, table, *, max_rows=1000, max_delay=1.0,
+                 max_buffer=None, use_copy=True, timeout=None, dialect=None):
+        """
+        :param pool: pool to take connections from for each flush
+        :param table: sqlalchemy Table to insert into
+        :param int max_rows: buffered rows that trigger a flush
+        :param float max_delay: seconds a row may wait before a flush
+        :param int max_buffer: rows buffered before `write` blocks
+                               (defaults to ten times max_rows)
+        :param bool use_copy: use COPY instead of executemany
+        :param float timeout: timeout for each flush
+        """
+        self.pool = pool
+        self.table = table
+        self.max_rows = max_rows
+        self.max_delay = max_delay
+        self.max_buffer = max_buffer or max_rows * 10
+        self.use_copy = use_copy
+        self.timeout = timeout
+        self._dialect = dialect or default_dialect()
+        self._rows = []
+        self._processors = {}
+        self._timer = None
+        self._flushing = None
+        self._lock = asyncio.Lock()
+        self._space = asyncio.Event()
+        self._space.set()
+        self._error = None
+        self._closed = False
+
+    def __len__(self):
+        return len(self._rows)
+
+    def write_nowait(self, row):
+        """
+        buffer a row (a dict of column name to value)
+        :raises BufferFullError: if the buffer is full
+        """
+        self._check()
+        if len(self._rows) >= self.max_buffer:
+            raise BufferFullError('{} rows are waiting to be written to {}'
+                                  .format(len(self._rows), self.table.name))
+        self._rows.append(row)
+        if len(self._rows) >= self.max_buffer:
+            self._space.clear()
+
+        if len(self._rows) >= self.max_rows:
+            self._start_flush()
+        elif self._timer is None:
+            loop = asyncio.get_event_loop()
+            self._timer = loop.call_later(self.max_delay, self._start_flush)
+
+    async def write(self, row):
+        """
+        buffer a row, waiting for a flush if the buffer is full
+        """
+        while len(self._rows) >= self.max_buffer:
+            self._check()
+            self._space.clear()
+            self._start_flush()
+            await self._space.wait()
+        self.write_nowait(row)
+
+    async def flush(self):
+        """
+        write everything buffered so far, including rows of failed flushes
+        """
+        if self._closed:
+            raise RuntimeError('writer is closed')
+        # an earlier failure is retried below, only report this one
+        self._error = None
+        await self._flush()
+        self._check()
+
+    async def close(self):
+        """
+        flush the remaining rows and stop accepting new ones
+        """
+        if self._closed:
+            return
+        await self.flush()
+        self._closed = True
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    def _check(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+        if self._closed:
+            raise RuntimeError('writer is closed')
+
+    def _start_flush(self):
+        if self._flushing is None or self._flushing.done():
+            self._flushing = asyncio.ensure_future(self._flush())
+
+    async def _flush(self):
+        async with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            while self._rows:
+                rows = self._rows[:self.max_rows]
+                try:
+                    await self._send(rows)
+                except Exception as e:
+                    # the rows stay buffered for the retry
+                    self._error = e
+                    self._space.set()
+                    self._timer = asyncio.get_event_loop().call_later(
+                        self.max_delay, self._start_flush)
+                    return
+                del self._rows[:len(rows)]
+                self._space.set()
+
+    async def _send(self, rows):
+        groups = {}
+        with span('asyncpgsa.process_rows') as s:
+            s.set('db.statement', 'INSERT INTO ' + self.table.fullname)
+            s.set('db.rows', len(rows))
+            for row in rows:
+                row = self._prepare_row(row)
+                groups.setdefault(tuple(row), []).append(tuple(row.values()))
+
+        # one transaction, so a failed flush can be retried as a whole
+        async with self.pool.acquire(timeout=self.timeout) as con, \
+                con.transaction():
+            for columns, records in groups.items():
+                if self.use_copy:
+                    await con.copy_records_to_table(
+                        self.table.name, records=records, columns=columns,
+                        schema_name=self.table.schema, timeout=self.timeout)
+                else:
+                    await con.executemany(self._insert_sql(columns), records,
+                                          timeout=self.timeout)
+
+    def _prepare_row(self, row):
+        row = dict(row)
+        for col in self.table.columns:
+            default = col.default
+            if default is None or row.get(col.name) is not None:
+                continue
+            if default.is_scalar:
+                row[col.name] = default.arg
+            elif default.is_callable:
+                row[col.name] = default.arg({})
+        return {key: self._processor(key)(value) if value is not None
+                else None for key, value in sorted(row.items())}
+
+    def _processor(self, name):
+        try:
+            return self._processors[name]
+        except KeyError:
+            processor = self.table.columns[name].type.bind_processor(
+                self._dialect) or _identity
+            self._processors[name] = processor
+            return processor
+
+    def _insert_sql(self, columns):
+        preparer = self._dialect.identifier_preparer
+        sql = 'INSERT INTO {} ({}) VALUES ({})'.format(
+            preparer.format_table(self.table),
+            ', '.join(preparer.quote(col) for col in columns),
+            ', '.join('$' + str(i) for i in range(1, len(columns) + 1)))
+        query_logger.debug(sql)
+        return sql
+
+
+def _identity(value):
+    return value
@@ -0,0 +1,182 @@
+"""
+a small client side cache for query results.
+Entries are keyed by compiled sql + params and remember which tables the
+statement read from, so writes to those tables can drop them.
+"""
+
+import sys
+import time
+from collections import OrderedDict
+
+from sqlalchemy.schema import Table
+from sqlalchemy.sql import ClauseElement, visitors
+from sqlalchemy.sql.dml import UpdateBase
+
+
+def referenced_tables(query):
+    """
+    names of all tables a sqlalchemy statement touches.
+    Strings are opaque, so they reference nothing.
+    """
+    if not isinstance(query, ClauseElement):
+        return frozenset()
+    return frozenset(elem.fullname for elem in visitors.iterate(query, {})
+                     if isinstance(elem, Table))
+
+
+def written_tables(query):
+    """
+    names of the tables an insert/update/delete statement writes to
+    """
+    if isinstance(query, UpdateBase):
+        return frozenset((query.table.fullname,))
+    return frozenset()
+
+
+def make_key(query, args):
+    key = (query, tuple(args))
+    try:
+        hash(key)
+    except TypeError:
+        # lists, dicts, etc. as parameters
+        key = (query, repr(key[1]))
+    return key
+
+
+class _Entry:
+    __slots__ = ('value', 'expires', 'tables', 'size')
+
+    def __init__(self, value, expires, tables, size):
+        self.value = value
+        self.expires = expires
+        self.tables = tables
+        self.size = size
+
+
+class QueryCache:
+    """
+    bounded LRU of query results with a ttl per entry
+    and invalidation by table name.
+    """
+
+    __slots__ = ('max_entries', '_entries', '_by_table', '_generation',
+                 '_invalidated', '_cleared', 'hits', 'misses', 'evictions',
+                 'invalidations', 'memory')
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._by_table = {}
+        # bumped by every invalidation, tables map to the last one that
+        # dropped them
+        self._generation = 0
+        self._invalidated = {}
+        self._cleared = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.memory = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """
+        :return: the cached value, or None if missing or expired
+        """
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry.expires < time.monotonic():
+            self._remove(key)
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry.value
+
+    def generation(self):
+        """
+        take this before running a query, and pass it to `set` with the
+        result
+        """
+        return self._generation
+
+    def set(self, key, value, ttl, tables=(), generation=None):
+        """
+        :param key: key from `make_key`
+        :param value: a list of records
+        :param float ttl: seconds the entry stays valid
+        :param tables: names of the tables the result was read from
+        :param int generation: from `generation` when the read started,
+                               the result is not cached if any of `tables`
+                               were invalidated since, as it may be stale
+        """
+        if generation is not None and self._stale(tables, generation):
+            return
+        if key in self._entries:
+            self._remove(key)
+        size = sys.getsizeof(value) + sum(sys.getsizeof(r) for r in value)
+        self._entries[key] = _Entry(value, time.monotonic() + ttl,
+                                    frozenset(tables), size)
+        self.memory += size
+        for table in tables:
+            self._by_table.setdefault(table, set()).add(key)
+
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def invalidate(self, tables):
+        """
+        drop every entry that read from any of `tables`
+        """
+        self._generation += 1
+        for table in tables:
+            self._invalidated[table] = self._generation
+            for key in self._by_table.pop(table, ()):
+                if key in self._entries:
+                    self._remove(key)
+                    self.invalidations += 1
+
+    def clear(self):
+        self._entries.clear()
+        self._by_table.clear()
+        self._generation += 1
+        self._invalidated.clear()
+        self._cleared = self._generation
+        self.memory = 0
+
+    def _stale(self, tables, generation):
+        if self._cleared > generation:
+            return True
+        return any(self._invalidated.get(table, 0) > generation
+                   for table in tables)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self.memory -= entry.size
+        for table in entry.tables:
+            keys = self._by_table.get(table)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_table[table]
+
+    @property
+    def hit_rate(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self):
+        return {
+            'entries': len(self._entries),
+            'memory': self.memory,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hit_rate,
+            'evictions': self.evictions,
+            'invalidations': self.invalidations,
+        }
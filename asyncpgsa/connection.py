@@ -1,14 +1,28 @@
-from asyncpg import connection
+import asyncio
+from collections import OrderedDict
+from time import perf_counter
+
+from asyncpg import connection, transaction
 from sqlalchemy import func
-from sqlalchemy.dialects.postgresql import pypostgresql
 from sqlalchemy.sql import ClauseElement
+from sqlalchemy.sql.elements import TextClause, _anonymous_label
 from sqlalchemy.sql.dml import Insert as InsertObject, Update as UpdateObject
+from sqlalchemy.sql.dml import UpdateBase
 from sqlalchemy.sql.ddl import DDLElement
+from sqlalchemy.sql.selectable import Alias, FromGrouping, Join
 
+from .bindpolicy import bind_processors
+from .cache import written_tables
+from .cursor import ChunkedCursor
+from .deadline import effective_timeout, no_deadline
 from .log import query_logger
+from .stats import count_rows
+from .tracing import off_loop, span
 
 
 def get_dialect(**kwargs):
+    from sqlalchemy.dialects.postgresql import pypostgresql
+
     dialect = pypostgresql.dialect(paramstyle='pyformat', **kwargs)
 
     dialect.implicit_returning = True
@@ -21,7 +35,17 @@ def get_dialect(**kwargs):
     return dialect
 
 
-_dialect = get_dialect()
+_dialect = None
+
+
+def default_dialect():
+    """
+    the dialect used when none is given, built on first use
+    """
+    global _dialect
+    if _dialect is None:
+        _dialect = get_dialect()
+    return _dialect
 
 
 def execute_defaults(query):
@@ -54,7 +78,15 @@ def _execute_default_attr(query, param, attr_name):
                 param[col.name] = attr.arg({})
 
 
-def compile_query(query, dialect=_dialect, inline=False):
+def compile_query(query, dialect=None, inline=False):
+    with span('asyncpgsa.compile') as s:
+        result = _compile_query(query, dialect or default_dialect(), inline)
+        s.set('db.statement',
+              result[0] if isinstance(result, tuple) else result)
+        return result
+
+
+def _compile_query(query, dialect, inline):
     if isinstance(query, str):
         query_logger.debug(query)
         return query, ()
@@ -72,9 +104,18 @@ def compile_query(query, dialect=_dialect, inline=False):
                    for i, (key, _) in enumerate(compiled_params, start=1)}
         new_query = compiled.string % mapping
 
-        processors = compiled._bind_processors
-        new_params = [processors[key](val) if key in processors else val
-                      for key, val in compiled_params]
+        with span('asyncpgsa.bind') as s:
+            s.set('db.statement', new_query)
+            processors = bind_processors(
+                compiled, [key for key, _ in compiled_params], dialect,
+                new_query)
+            if processors is None:
+                new_params = [val for _, val in compiled_params]
+            else:
+                new_params = [
+                    val if processor is None else processor(val)
+                    for processor, (_, val) in zip(processors,
+                                                   compiled_params)]
 
         query_logger.debug(new_query)
 
@@ -83,26 +124,403 @@ def compile_query(query, dialect=_dialect, inline=False):
         return new_query, new_params
 
 
+def statement_shape(query):
+    """
+    a cheap key for statements that probably cost about the same to
+    compile, or None for strings which are not compiled at all.
+    Equal statements built twice get equal keys, FROM clauses
+    included.
+    """
+    if isinstance(query, str):
+        return None
+    if isinstance(query, TextClause):
+        return query.text
+    if isinstance(query, UpdateBase):
+        rows = query.parameters
+        return (type(query), query.table.fullname,
+                len(rows) if isinstance(rows, list) else 1)
+    if isinstance(query, Join):
+        return (Join, statement_shape(query.left),
+                statement_shape(query.right))
+    if isinstance(query, Alias):
+        # CTEs too. anonymous names are made from id()
+        name = query.name
+        if isinstance(name, _anonymous_label):
+            name = None
+        return (type(query), name, statement_shape(query.element))
+    if isinstance(query, FromGrouping):
+        return statement_shape(query.element)
+    fullname = getattr(query, 'fullname', None)
+    if fullname is not None:
+        return fullname
+    parts = getattr(query, 'froms', None)
+    if parts is None:
+        # unions
+        parts = getattr(query, 'selects', None)
+    if parts is None:
+        # functions and other FROM clauses
+        return (type(query), getattr(query, 'name', None))
+    return (type(query), tuple(statement_shape(part) for part in parts))
+
+
+class CompileOffloader:
+    """
+    Learns the compile time of each statement shape, and compiles shapes
+    that took more than `threshold` seconds in `executor` (the loop's
+    default executor if None) instead of on the event loop.
+    Cheap shapes keep compiling inline.
+    """
+
+    __slots__ = ('threshold', 'executor', 'max_shapes', 'costs')
+
+    def __init__(self, threshold=0.005, executor=None, max_shapes=1000):
+        self.threshold = threshold
+        self.executor = executor
+        self.max_shapes = max_shapes
+        self.costs = OrderedDict()
+
+    def is_heavy(self, shape):
+        return self.costs.get(shape, 0.0) > self.threshold
+
+    async def compile(self, query, dialect=None, inline=False):
+        shape = statement_shape(query)
+        if shape is None:
+            return compile_query(query, dialect=dialect, inline=inline)
+
+        start = perf_counter()
+        if self.is_heavy(shape):
+            loop = asyncio.get_event_loop()
+            result = await loop.run_in_executor(
+                self.executor, _compile_off_loop, query, dialect, inline)
+        else:
+            result = compile_query(query, dialect=dialect, inline=inline)
+        self._learn(shape, perf_counter() - start)
+        return result
+
+    def _learn(self, shape, cost):
+        previous = self.costs.pop(shape, None)
+        # moving average, so one slow compile does not decide alone
+        self.costs[shape] = cost if previous is None \
+            else previous * 0.8 + cost * 0.2
+        if len(self.costs) > self.max_shapes:
+            self.costs.popitem(last=False)
+
+
+def _compile_off_loop(query, dialect, inline):
+    with off_loop():
+        return compile_query(query, dialect=dialect, inline=inline)
+
+
+async def compile_query_async(query, dialect=None, inline=False,
+                              offloader=None):
+    """
+    like compile_query, but heavy statements are compiled in a thread
+    by `offloader` (a `CompileOffloader`)
+    """
+    if offloader is None:
+        return compile_query(query, dialect=dialect, inline=inline)
+    return await offloader.compile(query, dialect=dialect, inline=inline)
+
+
+class _Transaction(transaction.Transaction):
+    """
+    ends the transaction even after the deadline passed, a timed out
+    COMMIT or ROLLBACK would only make asyncpg terminate the connection
+    """
+
+    __slots__ = ()
+
+    async def __aexit__(self, extype, ex, tb):
+        with no_deadline():
+            return await super().__aexit__(extype, ex, tb)
+
+    async def commit(self):
+        with no_deadline():
+            return await super().commit()
+
+    async def rollback(self):
+        with no_deadline():
+            return await super().rollback()
+
+
 class SAConnection(connection.Connection):
-    def __init__(self, *args, dialect=None, **kwargs):
+    def __init__(self, *args, dialect=None, statement_stats=None,
+                 slow_query_log=None, compile_offloader=None,
+                 statement_registry=None, statement_cache_stats=None,
+                 pgbouncer_mode=False, **kwargs):
         super().__init__(*args, **kwargs)
-        self._dialect = dialect or _dialect
+        self._dialect = dialect or default_dialect()
+        self._compile_offloader = compile_offloader
+        self._statement_registry = statement_registry
+        self._statement_cache_stats = statement_cache_stats
+        self._pgbouncer_mode = pgbouncer_mode
+        self._statement_stats = statement_stats
+        self._slow_query_log = slow_query_log
+        self._written_tables = None
+        self._deferred = None
 
-    def _execute(self, query, args, limit, timeout, return_status=False, record_class=None, ignore_custom_codec=False):
-        query, compiled_args = compile_query(query, dialect=self._dialect)
+    def _track_writes(self):
+        """
+        start recording the tables written to by this connection
+        """
+        self._written_tables = set()
+
+    def _pop_written_tables(self):
+        tables, self._written_tables = self._written_tables or set(), None
+        return tables
+
+    def _defer_writes(self):
+        """
+        queue statements run with `execute` instead of sending them,
+        until the next read or `flush_deferred`
+        """
+        self._deferred = []
+
+    def _stop_deferring(self):
+        self._deferred = None
+
+    async def flush_deferred(self, timeout=None):
+        """
+        send the statements queued by `execute` in deferred mode
+        """
+        statements, self._deferred = self._deferred, None
+        if statements is None:
+            return
+        try:
+            await self._execute_batch(statements, timeout=timeout)
+        finally:
+            self._deferred = []
+
+    async def _execute_batch(self, statements, timeout=None):
+        """
+        run compiled (sql, args) pairs in order, with as few round trips
+        as possible: runs of parameterless statements are sent as one
+        simple query, runs of the same parameterized sql as one executemany.
+        Parameterized statements that return rows are run one at a time.
+
+        :return: a result for each statement, see `execute_pipeline`
+        """
+        results = []
+        i = 0
+        while i < len(statements):
+            sql, args = statements[i]
+            j = i + 1
+            if args:
+                statement = await self._prepare_cached(
+                    sql, effective_timeout(timeout))
+                if statement._get_attributes():
+                    results.append(await self._execute_compiled(
+                        sql, args, 0, timeout, 0.0))
+                    i = j
+                    continue
+                while j < len(statements) and statements[j][0] == sql \
+                        and statements[j][1]:
+                    j += 1
+                await super().executemany(
+                    sql, [args for _, args in statements[i:j]],
+                    timeout=effective_timeout(timeout))
+                results.extend([None] * (j - i))
+            else:
+                while j < len(statements) and not statements[j][1]:
+                    j += 1
+                # a statement may end in a -- comment
+                status = await super().execute(
+                    '\n;\n'.join(sql for sql, _ in statements[i:j]),
+                    timeout=effective_timeout(timeout))
+                # the server only reports the status of a script's last
+                # statement
+                results.extend([None] * (j - i - 1) + [status])
+            i = j
+        return results
+
+    async def execute_pipeline(self, statements, *, timeout=None):
+        """
+        run `statements` in order with as few round trips as possible,
+        see `_execute_batch`. Outside a transaction each run of
+        parameterless statements is one script, which postgres runs as one
+        implicit transaction, so a failure rolls back the whole run (and
+        statements that cannot run in a transaction block, like VACUUM,
+        fail when combined). Other statements commit one by one, like
+        separate `execute` calls. Run the pipeline in a transaction to
+        make it atomic.
+
+        await conn.execute_pipeline([
+            'CREATE TEMP TABLE t (id int)',
+            t.insert().values(id=1),
+            t.insert().values(id=2),
+        ])
+
+        :param statements: statements or sql, or tuples of sql and its args
+        :return: for each statement the rows it returned if it returns any
+                 (e.g. with RETURNING) and has parameters, the status of
+                 the last statement of each run of parameterless ones,
+                 None otherwise. Rows of parameterless statements are
+                 discarded, `fetch` those instead
+        """
+        timeout = effective_timeout(timeout)
+        if self._deferred:
+            await self.flush_deferred(timeout=timeout)
+        compiled = []
+        for statement in statements:
+            query, *args = statement if isinstance(statement, tuple) \
+                else (statement,)
+            if self._written_tables is not None:
+                self._written_tables.update(written_tables(query))
+            sql, params = await compile_query_async(
+                query, dialect=self._dialect,
+                offloader=self._compile_offloader)
+            compiled.append((sql, params or args))
+        return await self._execute_batch(compiled, timeout=timeout)
+
+    async def _execute(self, query, args, limit, timeout, return_status=False, record_class=None, ignore_custom_codec=False):
+        if self._written_tables is not None:
+            self._written_tables.update(written_tables(query))
+        start = perf_counter()
+        query, compiled_args = await compile_query_async(
+            query, dialect=self._dialect, offloader=self._compile_offloader)
         args = compiled_args or args
-        return super()._execute(query, args, limit, timeout,
-                                return_status=return_status,
-                                record_class=record_class,
-                                ignore_custom_codec=ignore_custom_codec)
+        return await self._execute_compiled(
+            query, args, limit, timeout, perf_counter() - start,
+            return_status=return_status,
+            record_class=record_class,
+            ignore_custom_codec=ignore_custom_codec)
+
+    async def _execute_compiled(self, query, args, limit, timeout,
+                                compile_time, observe=True, **kwargs):
+        """
+        :param bool observe: record the statement in the stats and slow
+                             query log
+        """
+        timeout = effective_timeout(timeout)
+        if self._deferred:
+            await self.flush_deferred(timeout=timeout)
+        with span('asyncpgsa.execute') as s:
+            s.set('db.statement', query)
+            if not observe or self._statement_stats is None and \
+                    self._slow_query_log is None:
+                return await super()._execute(query, args, limit, timeout,
+                                              **kwargs)
+
+            start = perf_counter()
+            try:
+                result = await super()._execute(query, args, limit, timeout,
+                                                **kwargs)
+            except Exception:
+                self._observe(query, args, compile_time,
+                              perf_counter() - start, error=True)
+                raise
+            self._observe(query, args, compile_time,
+                          perf_counter() - start, count_rows(result))
+            return result
+
+    def _observe(self, query, args, compile_time, execute_time, rows=0,
+                 error=False):
+        if self._statement_stats is not None:
+            self._statement_stats.record(query, compile_time, execute_time,
+                                         rows, error)
+        if self._slow_query_log is not None:
+            self._slow_query_log.record(query, args,
+                                        compile_time + execute_time)
+
+    async def _get_statement(self, query, timeout, **kwargs):
+        timeout = effective_timeout(timeout)
+        # prepare() and cursors read outside of _execute
+        if self._deferred and not self._stmt_exclusive_section._acquired:
+            await self.flush_deferred(timeout=timeout)
+        if self._statement_registry is not None \
+                and kwargs.get('use_cache', True):
+            self._statement_registry.record(query)
+        if self._statement_cache_stats is not None:
+            self._record_cache_lookup(query, kwargs)
+        return await super()._get_statement(query, timeout, **kwargs)
+
+    def _record_cache_lookup(self, query, kwargs):
+        stats = self._statement_cache_stats
+        if not kwargs.get('use_cache', True):
+            stats.record(query, named=True)
+            return
+
+        cache = self._stmt_cache
+        max_size = cache.get_max_size()
+        # same key asyncpg's _get_statement uses
+        key = (query,
+               kwargs.get('record_class') or self._protocol.get_record_class(),
+               kwargs.get('ignore_custom_codec', False))
+        miss = not cache.has(key)
+        evicted = miss and 0 < max_size <= len(cache)
+        stats.record(query, miss=miss, evicted=evicted, connection=self)
+
+        if evicted and stats.auto_resize and stats.thrashing(self):
+            size = stats.suggested_size()
+            if size > max_size:
+                cache.set_max_size(size)
+                stats.resizes += 1
+
+    async def _prepare_cached(self, sql, timeout=None):
+        """
+        prepare `sql` into the statement cache without counting it as a use
+        """
+        return await super()._get_statement(sql, timeout)
 
     async def execute(self, script, *args, **kwargs) -> str:
-        script, params = compile_query(script, dialect=self._dialect)
+        """
+        in deferred mode the statement is queued and None is returned
+        """
+        kwargs['timeout'] = effective_timeout(kwargs.get('timeout'))
+        if self._written_tables is not None:
+            self._written_tables.update(written_tables(script))
+        start = perf_counter()
+        script, params = await compile_query_async(
+            script, dialect=self._dialect, offloader=self._compile_offloader)
+        compile_time = perf_counter() - start
         args = params or args
-        result = await super().execute(script, *args, **kwargs)
-        return result
+        if self._deferred is not None:
+            self._deferred.append((script, args))
+            return None
+
+        if args:
+            # what Connection.execute does, minus compiling again
+            self._check_open()
+            _, status, _ = await self._execute_compiled(
+                script, args, 0, kwargs.get('timeout'), compile_time,
+                return_status=True)
+            return status.decode()
+
+        with span('asyncpgsa.execute') as s:
+            s.set('db.statement', script)
+            if self._statement_stats is None and \
+                    self._slow_query_log is None:
+                return await super().execute(script, **kwargs)
+            start = perf_counter()
+            try:
+                result = await super().execute(script, **kwargs)
+            except Exception:
+                self._observe(script, args, compile_time,
+                              perf_counter() - start, error=True)
+                raise
+            self._observe(script, args, compile_time, perf_counter() - start)
+            return result
+
+    async def executemany(self, command, args, *, timeout=None):
+        timeout = effective_timeout(timeout)
+        if self._deferred:
+            await self.flush_deferred(timeout=timeout)
+        return await super().executemany(command, args, timeout=timeout)
+
+    def transaction(self, *, isolation=None, readonly=False,
+                    deferrable=False):
+        self._check_open()
+        return _Transaction(self, isolation, readonly, deferrable)
 
     def cursor(self, query, *args, prefetch=None, timeout=None):
+        start = perf_counter()
         query, compiled_args = compile_query(query, dialect=self._dialect)
         args = compiled_args or args
+        if self._statement_stats is not None:
+            # rows are streamed later, so this is not timed as a call
+            self._statement_stats.record_compile(query,
+                                                 perf_counter() - start)
+        if self._pgbouncer_mode:
+            return ChunkedCursor(self, query, args, prefetch=prefetch,
+                                 timeout=timeout)
         return super().cursor(query, *args, prefetch=prefetch, timeout=timeout)
@@ -0,0 +1,94 @@
+"""
+cursors that do not need named prepared statements
+"""
+
+from collections import deque
+
+from asyncpg import exceptions
+
+
+class ChunkedCursor:
+    """
+    A server side cursor opened with DECLARE and read with FETCH, so every
+    statement is unnamed. Used instead of asyncpg cursors behind PgBouncer
+    in transaction pooling mode. Like asyncpg cursors it only lives as
+    long as the surrounding transaction.
+
+    Iterate it with `async for`, or `await` it for `fetch`/`fetchrow`/
+    `forward`. Like for asyncpg cursors, statement stats only record the
+    compile time of `query`; the DECLARE and FETCH statements, which
+    contain the unique cursor name, are not recorded.
+    """
+
+    __slots__ = ('connection', 'query', 'args', 'prefetch', 'timeout',
+                 'name', '_buffer', '_exhausted')
+
+    def __init__(self, connection, query, args, prefetch=None,
+                 timeout=None):
+        self.connection = connection
+        self.query = query
+        self.args = args
+        self.prefetch = prefetch or 50
+        self.timeout = timeout
+        self.name = None
+        self._buffer = deque()
+        self._exhausted = False
+
+    def __await__(self):
+        return self._open().__await__()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self._buffer:
+            if self.name is None:
+                await self._open()
+            if self._exhausted:
+                raise StopAsyncIteration
+            rows = await self._fetch(self.prefetch)
+            self._exhausted = len(rows) < self.prefetch
+            if not rows:
+                raise StopAsyncIteration
+            self._buffer.extend(rows)
+        return self._buffer.popleft()
+
+    async def fetch(self, n, *, timeout=None):
+        """
+        :return: the next `n` rows
+        """
+        return await self._fetch(n, timeout)
+
+    async def fetchrow(self, *, timeout=None):
+        rows = await self._fetch(1, timeout)
+        return rows[0] if rows else None
+
+    async def forward(self, n, *, timeout=None):
+        """
+        skip `n` rows
+        :return: the number of rows skipped
+        """
+        _, status, _ = await self._run(
+            'MOVE FORWARD {:d} FROM {}'.format(n, self.name), (),
+            timeout, return_status=True)
+        return int(status.decode().split()[-1])
+
+    async def _open(self):
+        if not self.connection.is_in_transaction():
+            raise exceptions.NoActiveSQLTransactionError(
+                'cursor cannot be created outside of a transaction')
+        self.name = self.connection._get_unique_id('cursor')
+        await self._run(
+            'DECLARE {} NO SCROLL CURSOR FOR {}'.format(self.name,
+                                                        self.query),
+            self.args, None, return_status=True)
+        return self
+
+    async def _fetch(self, n, timeout=None):
+        return await self._run(
+            'FETCH FORWARD {:d} FROM {}'.format(n, self.name), (), timeout)
+
+    def _run(self, sql, args, timeout, **kwargs):
+        return self.connection._execute_compiled(
+            sql, args, 0, timeout or self.timeout, 0.0, observe=False,
+            **kwargs)
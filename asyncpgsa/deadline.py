@@ -0,0 +1,78 @@
+"""
+deadlines that cover acquiring a connection and every statement after it
+"""
+
+import asyncio
+import contextlib
+import time
+from contextvars import ContextVar
+
+
+_deadline = ContextVar('asyncpgsa_deadline', default=None)
+
+
+class DeadlineExceeded(asyncio.TimeoutError):
+    """
+    raised instead of starting work once the deadline has passed
+    """
+
+
+@contextlib.contextmanager
+def deadline(seconds):
+    """
+    Give everything inside this block `seconds` in total: waiting for a
+    pool connection and each statement get the remaining time as their
+    timeout, so asyncpg cancels a statement on the server when the
+    deadline fires, and transactions started inside the block set
+    `statement_timeout` to it. Nested deadlines can only shorten it.
+    Ending a transaction and releasing the connection are not limited.
+
+    with deadline(0.5):
+        async with pg.transaction() as conn:
+            await conn.fetch(query)
+    """
+    at = time.monotonic() + seconds
+    outer = _deadline.get()
+    token = _deadline.set(at if outer is None else min(at, outer))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+@contextlib.contextmanager
+def no_deadline():
+    """
+    lift the current deadline inside this block, for cleanup that has to
+    run even once it passed, like COMMIT/ROLLBACK and resetting a
+    released connection
+    """
+    token = _deadline.set(None)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining():
+    """
+    :return: seconds left until the current deadline, or None without one
+    """
+    at = _deadline.get()
+    if at is None:
+        return None
+    return at - time.monotonic()
+
+
+def effective_timeout(timeout):
+    """
+    :param float timeout: the timeout a caller asked for, or None
+    :return: the smaller of `timeout` and the time left
+    :raises DeadlineExceeded: if no time is left
+    """
+    left = remaining()
+    if left is None:
+        return timeout
+    if left <= 0:
+        raise DeadlineExceeded('deadline exceeded by {:.3f}s'.format(-left))
+    return left if timeout is None else min(timeout, left)
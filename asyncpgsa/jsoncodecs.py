@@ -0,0 +1,64 @@
+"""
+json/jsonb codecs, so values are serialized once, by asyncpg
+"""
+
+import json
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+# jsonb's binary format is the text prefixed with a version byte
+_JSONB_VERSION = b'\x01'
+
+
+if orjson is not None:
+    _dumps = orjson.dumps
+    _loads = orjson.loads
+else:  # pragma: no cover
+    def _dumps(value):
+        return json.dumps(value, separators=(',', ':')).encode()
+
+    _loads = json.loads
+
+
+def passthrough(value):
+    """
+    json serializer for the dialect once asyncpg encodes json itself
+    """
+    return value
+
+
+async def register_json_codecs(conn, dumps=None, loads=None):
+    """
+    encode and decode json and jsonb on `conn` in binary format,
+    with orjson when it is installed
+
+    :param dumps: callable returning str or bytes
+    :param loads: callable taking str
+    """
+    encode = _dumps if dumps is None else _bytes(dumps)
+    decode = _loads if loads is None else _text(loads)
+
+    await conn.set_type_codec(
+        'json', schema='pg_catalog', format='binary',
+        encoder=encode, decoder=decode)
+    await conn.set_type_codec(
+        'jsonb', schema='pg_catalog', format='binary',
+        encoder=lambda value: _JSONB_VERSION + encode(value),
+        decoder=lambda data: decode(data[1:]))
+
+
+def _text(loads):
+    def decode(data):
+        return loads(bytes(data).decode())
+    return decode
+
+
+def _bytes(dumps):
+    def encode(value):
+        data = dumps(value)
+        return data.encode() if isinstance(data, str) else data
+    return encode
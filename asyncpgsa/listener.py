@@ -0,0 +1,219 @@
+"""
+managed LISTEN/NOTIFY on a dedicated connection
+"""
+
+import asyncio
+import json
+from collections import namedtuple
+
+from .connection import default_dialect
+from .log import listener_logger
+
+
+TABLE_CHANGE_CHANNEL = 'asyncpgsa_table_change'
+
+Notification = namedtuple('Notification', ('pid', 'channel', 'payload'))
+
+
+class Listener:
+    """
+    Keeps one connection open (outside of any pool rotation) that LISTENs
+    on every registered channel, reconnecting when it is lost.
+    Notifications are queued and handed to handlers in batches, so a burst
+    of notifications turns into few handler calls.
+
+    Handlers are coroutine functions taking a list of `Notification`.
+    """
+
+    __slots__ = ('_connect', '_handlers', '_queue', '_con', '_tasks',
+                 '_pending', '_semaphore', '_closed', '_lost',
+                 'batch_size', 'batch_delay', 'reconnect_delay',
+                 'max_reconnect_delay', 'on_reconnect')
+
+    def __init__(self, connect, *, max_concurrency=10, batch_size=100,
+                 batch_delay=0.01, reconnect_delay=0.5,
+                 max_reconnect_delay=30.0, on_reconnect=None):
+        """
+        :param connect: coroutine function returning a new connection
+        :param int max_concurrency: max handler calls running at once
+        :param int batch_size: max notifications passed to one handler call
+        :param float batch_delay: seconds to wait for a burst to accumulate
+        :param on_reconnect: optional callable, called after the connection
+                             was re-established. Notifications sent while
+                             disconnected are lost, so this is the place to
+                             drop anything derived from them.
+        """
+        self._connect = connect
+        self._handlers = {}
+        self._queue = asyncio.Queue()
+        self._con = None
+        self._tasks = []
+        self._pending = set()
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._closed = False
+        self._lost = None
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.on_reconnect = on_reconnect
+
+    @property
+    def connected(self):
+        return self._con is not None and not self._con.is_closed()
+
+    async def add(self, channel, handler):
+        handlers = self._handlers.setdefault(channel, [])
+        handlers.append(handler)
+        if not self._tasks:
+            await self.start()
+        elif len(handlers) == 1 and self.connected:
+            await self._con.add_listener(channel, self._notify)
+
+    async def remove(self, channel, handler):
+        handlers = self._handlers.get(channel, [])
+        if handler in handlers:
+            handlers.remove(handler)
+        if not handlers:
+            self._handlers.pop(channel, None)
+            if self.connected:
+                await self._con.remove_listener(channel, self._notify)
+
+    async def start(self):
+        """
+        connect and start dispatching. Raises if the first connect fails.
+        """
+        if self._closed:
+            raise RuntimeError('listener is closed')
+        await self._open()
+        loop = asyncio.get_event_loop()
+        self._tasks = [loop.create_task(self._keep_connected()),
+                       loop.create_task(self._dispatch())]
+
+    async def close(self):
+        self._closed = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
+        if self._con is not None:
+            await self._con.close()
+            self._con = None
+
+    async def _open(self):
+        self._lost = asyncio.Event()
+        con = await self._connect()
+        try:
+            con.add_termination_listener(lambda _: self._lost.set())
+            for channel in self._handlers:
+                await con.add_listener(channel, self._notify)
+        except BaseException:
+            # the caller retries with a new connection
+            con.terminate()
+            raise
+        self._con = con
+
+    async def _keep_connected(self):
+        while not self._closed:
+            await self._lost.wait()
+            listener_logger.warning('listener connection lost, reconnecting')
+            delay = self.reconnect_delay
+            while True:
+                try:
+                    await self._open()
+                    break
+                except asyncio.CancelledError:
+                    raise
+                except Exception:
+                    listener_logger.exception('listener reconnect failed')
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, self.max_reconnect_delay)
+            if self.on_reconnect is not None:
+                self.on_reconnect()
+
+    def _notify(self, con, pid, channel, payload):
+        self._queue.put_nowait(Notification(pid, channel, payload))
+
+    async def _dispatch(self):
+        while True:
+            batch = [await self._queue.get()]
+            if self.batch_delay:
+                await asyncio.sleep(self.batch_delay)
+            while len(batch) < self.batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+
+            by_channel = {}
+            for notification in batch:
+                by_channel.setdefault(notification.channel, []).append(
+                    notification)
+
+            for channel, notifications in by_channel.items():
+                for handler in list(self._handlers.get(channel, ())):
+                    await self._semaphore.acquire()
+                    task = asyncio.ensure_future(
+                        self._call(handler, notifications))
+                    self._pending.add(task)
+                    task.add_done_callback(self._pending.discard)
+
+    async def _call(self, handler, notifications):
+        try:
+            await handler(notifications)
+        except Exception:
+            listener_logger.exception('notification handler %r failed',
+                                      handler)
+        finally:
+            self._semaphore.release()
+
+
+def _quote_literal(value):
+    return "'" + value.replace("'", "''") + "'"
+
+
+def table_change_trigger(table, channel=TABLE_CHANGE_CHANNEL, dialect=None):
+    """
+    DDL statements that make every write to `table` send a notification on
+    `channel`. The payload is a json object like
+    {"table": "<table.fullname>", "op": "INSERT"}, which is what
+    `PG.listen_cache_invalidations` expects.
+
+    :param table: sqlalchemy Table
+    :return: list of sql strings, run them with `execute`
+    """
+    preparer = (dialect or default_dialect()).identifier_preparer
+    trigger = preparer.quote('asyncpgsa_{}_change'.format(table.name))
+    return [
+        """
+        CREATE OR REPLACE FUNCTION asyncpgsa_notify_table_change()
+        RETURNS trigger AS $$
+        BEGIN
+            PERFORM pg_notify(TG_ARGV[0], json_build_object(
+                'table', TG_ARGV[1], 'op', TG_OP)::text);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+        """,
+        'DROP TRIGGER IF EXISTS {} ON {}'.format(
+            trigger, preparer.format_table(table)),
+        """
+        CREATE TRIGGER {} AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE
+        ON {} FOR EACH STATEMENT
+        EXECUTE PROCEDURE asyncpgsa_notify_table_change({}, {})
+        """.format(trigger, preparer.format_table(table),
+                   _quote_literal(channel), _quote_literal(table.fullname)),
+    ]
+
+
+def tables_from_notifications(notifications):
+    """
+    table names from notifications sent by `table_change_trigger`
+    """
+    tables = set()
+    for notification in notifications:
+        try:
+            tables.add(json.loads(notification.payload)['table'])
+        except (ValueError, KeyError, TypeError):
+            listener_logger.warning('unexpected table change payload %r',
+                                    notification.payload)
+    return tables
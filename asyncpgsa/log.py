@@ -1,3 +1,7 @@
 import logging
 
 query_logger = logging.getLogger('asyncpgsa.query')
+listener_logger = logging.getLogger('asyncpgsa.listener')
+slow_query_logger = logging.getLogger('asyncpgsa.slow_query')
+blocking_logger = logging.getLogger('asyncpgsa.blocking')
+pool_logger = logging.getLogger('asyncpgsa.pool')
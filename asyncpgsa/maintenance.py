@@ -0,0 +1,170 @@
+"""
+keeping idle pool connections healthy
+"""
+
+import asyncio
+import time
+import weakref
+
+import asyncpg
+from asyncpg.pool import PoolConnectionHolder
+
+from .log import pool_logger
+
+
+def _asyncpg_version():
+    return tuple(int(part) for part in asyncpg.__version__.split('.')[:2])
+
+
+class IdleSlots:
+    """
+    The idle slots of a pool, asyncpg `PoolConnectionHolder`s.
+    asyncpg has no public api for them, so this is the only place
+    reaching into its internals: the idle queue `Pool._queue` and the
+    holders' `_con`, laid out like this since asyncpg 0.25.
+    """
+
+    __slots__ = ('_queue',)
+
+    def __init__(self, pool):
+        queue = getattr(pool, '_queue', None)
+        if _asyncpg_version() < (0, 25) \
+                or not isinstance(queue, asyncio.Queue) \
+                or '_con' not in PoolConnectionHolder.__slots__:
+            raise RuntimeError(
+                'asyncpg {} does not keep idle pool connections the way '
+                'asyncpgsa expects'.format(asyncpg.__version__))
+        self._queue = queue
+
+    def take(self, accept):
+        """
+        take the first idle slot that `accept(holder)` is true for, so
+        nobody else can acquire it, and leave the others in their order
+
+        :return: the holder, or None
+        """
+        queue = self._queue
+        skipped = []
+        taken = None
+        while taken is None and not queue.empty():
+            holder = queue.get_nowait()
+            if accept(holder):
+                taken = holder
+            else:
+                skipped.append(holder)
+        for holder in reversed(skipped):
+            queue.put_nowait(holder)
+        return taken
+
+    def put(self, holder):
+        """
+        make a slot taken with `take` acquirable again
+        """
+        self._queue.put_nowait(holder)
+
+    @staticmethod
+    def connection(holder):
+        """
+        :return: the connection of a slot, None when disconnected
+        """
+        return holder._con
+
+
+class PoolMaintainer:
+    """
+    Every `interval` seconds takes each idle connection out of the pool
+    in turn and, off the request path:
+
+    - probes it with `SELECT 1`, and replaces it if the probe fails
+    - recycles it once `max_age` seconds passed since the maintainer first
+      saw it, if `max_age` is set
+
+    Replaced connections are reopened before their slot goes back to
+    the pool, with the pool's connect arguments and so its connect
+    timeout. If that fails the next acquire of the slot tries again.
+    """
+
+    __slots__ = ('pool', 'interval', 'probe_timeout', 'max_age', 'probes',
+                 'failures', 'recycled', '_born', '_task')
+
+    def __init__(self, interval=10.0, *, probe_timeout=1.0, max_age=None):
+        """
+        :param float interval: seconds between rounds
+        :param float probe_timeout: seconds a probe may take
+        :param float max_age: seconds before a connection is recycled,
+                              None to never recycle healthy ones
+        """
+        self.pool = None
+        self.interval = interval
+        self.probe_timeout = probe_timeout
+        self.max_age = max_age
+        self.probes = 0
+        self.failures = 0
+        self.recycled = 0
+        self._born = weakref.WeakKeyDictionary()
+        self._task = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.maintain()
+            except Exception:
+                pool_logger.exception('pool maintenance failed')
+
+    async def maintain(self):
+        """
+        one round over the idle connections
+        """
+        slots = IdleSlots(self.pool)
+        done = set()
+        while True:
+            holder = slots.take(
+                lambda h: h.is_connected() and h not in done)
+            if holder is None:
+                return
+            done.add(holder)
+            try:
+                await self._maintain(holder, slots.connection(holder))
+            finally:
+                slots.put(holder)
+
+    async def _maintain(self, holder, con):
+        now = time.monotonic()
+        born = self._born.setdefault(con, now)
+        if self.max_age is not None and now - born > self.max_age:
+            self.recycled += 1
+            await holder.close()
+            await self._reconnect(holder)
+            return
+
+        self.probes += 1
+        try:
+            await con.fetchval('SELECT 1', timeout=self.probe_timeout)
+        except Exception as e:
+            self.failures += 1
+            pool_logger.warning('replacing broken pool connection: %s', e)
+            holder.terminate()
+            await self._reconnect(holder)
+
+    async def _reconnect(self, holder):
+        # asyncpg versions that maintain min_size may have beaten us to it
+        if holder.is_connected() or self.pool.is_closing():
+            return
+        try:
+            await holder.connect()
+        except Exception as e:
+            pool_logger.warning('could not reopen pool connection: %s', e)
@@ -0,0 +1,225 @@
+"""
+metrics about pool usage, and exporters for them
+"""
+
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """
+    fixed bucket histogram of durations in seconds
+    """
+
+    __slots__ = ('buckets', 'counts', 'count', 'sum', 'max')
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        # the last count is for values above every bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        """
+        upper bound of the bucket holding the q-th quantile
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.max
+
+    def reset(self):
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def since(self, snapshot):
+        """
+        a histogram of what was observed after `snapshot` was taken.
+        Its max is exact if the max grew since, otherwise it is the upper
+        bound of the highest bucket that got values.
+        """
+        delta = Histogram(self.buckets)
+        delta.counts = [now - then for now, then
+                        in zip(self.counts, snapshot['counts'])]
+        delta.count = self.count - snapshot['count']
+        delta.sum = self.sum - snapshot['sum']
+        if self.max > snapshot['max']:
+            delta.max = self.max
+        else:
+            bounds = self.buckets + (self.max,)
+            delta.max = next(
+                (min(bound, self.max) for bound, count
+                 in zip(reversed(bounds), reversed(delta.counts)) if count),
+                0.0)
+        return delta
+
+    def snapshot(self):
+        return {
+            'buckets': self.buckets,
+            'counts': list(self.counts),
+            'count': self.count,
+            'sum': self.sum,
+            'max': self.max,
+        }
+
+
+class PoolMetrics:
+    """
+    Metrics recorded by `SAPool`.
+
+    acquire_wait: seconds callers waited in `acquire`
+    hold_time: seconds connections were held before `release`
+    waiters: callers currently waiting in `acquire`
+    in_use: connections currently acquired
+    """
+
+    __slots__ = ('pool', 'acquire_wait', 'hold_time', 'waiters', 'in_use',
+                 'acquires', 'timeouts', 'exporters')
+
+    def __init__(self, pool, buckets=DEFAULT_BUCKETS):
+        self.pool = pool
+        self.acquire_wait = Histogram(buckets)
+        self.hold_time = Histogram(buckets)
+        self.waiters = 0
+        self.in_use = 0
+        self.acquires = 0
+        self.timeouts = 0
+        self.exporters = []
+
+    @property
+    def size(self):
+        return self.pool.get_size()
+
+    def snapshot(self):
+        size = self.size
+        return {
+            'acquire_wait': self.acquire_wait.snapshot(),
+            'hold_time': self.hold_time.snapshot(),
+            'size': size,
+            'max_size': self.pool.get_max_size(),
+            'in_use': self.in_use,
+            'idle': max(size - self.in_use, 0),
+            'waiters': self.waiters,
+            'acquires': self.acquires,
+            'timeouts': self.timeouts,
+        }
+
+    def add_exporter(self, exporter):
+        self.exporters.append(exporter)
+
+    def export(self):
+        """
+        pass a snapshot to every exporter
+        :return: list of what each exporter returned
+        """
+        snapshot = self.snapshot()
+        return [exporter.export(snapshot) for exporter in self.exporters]
+
+
+class MetricsExporter(ABC):
+    """
+    Base class for metrics exporters. `export` gets a snapshot dict
+    (see `PoolMetrics.snapshot`) each time `PoolMetrics.export` is called.
+    """
+
+    @abstractmethod
+    def export(self, snapshot):
+        """
+        :return: anything, collected by `PoolMetrics.export`
+        """
+
+
+class PrometheusExporter(MetricsExporter):
+    """
+    renders snapshots in the prometheus text format, the last rendering
+    is kept in `text` so it can be served from a /metrics endpoint
+    """
+
+    def __init__(self, prefix='asyncpgsa_pool', labels=None):
+        self.prefix = prefix
+        self.labels = labels or {}
+        self.text = ''
+
+    def export(self, snapshot):
+        self.text = render_prometheus(snapshot, self.prefix, self.labels)
+        return self.text
+
+
+_GAUGES = (
+    ('size', 'Open connections.'),
+    ('max_size', 'Maximum number of connections.'),
+    ('in_use', 'Connections currently acquired.'),
+    ('idle', 'Open connections not acquired.'),
+    ('waiters', 'Callers waiting to acquire a connection.'),
+)
+_COUNTERS = (
+    ('acquires', 'Connections acquired.'),
+    ('timeouts', 'Acquire calls that timed out.'),
+)
+_HISTOGRAMS = (
+    ('acquire_wait', 'Seconds spent waiting to acquire a connection.'),
+    ('hold_time', 'Seconds a connection was held before release.'),
+)
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(
+        key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for key, value in sorted(labels.items())) + '}'
+
+
+def render_prometheus(snapshot, prefix='asyncpgsa_pool', labels=None):
+    """
+    render a `PoolMetrics` snapshot in the prometheus text exposition format
+    """
+    labels = labels or {}
+    label_str = _format_labels(labels)
+    lines = []
+    for key, help_text in _GAUGES:
+        name = '{}_{}'.format(prefix, key)
+        lines.append('# HELP {} {}'.format(name, help_text))
+        lines.append('# TYPE {} gauge'.format(name))
+        lines.append('{}{} {}'.format(name, label_str, snapshot[key]))
+    for key, help_text in _COUNTERS:
+        name = '{}_{}_total'.format(prefix, key)
+        lines.append('# HELP {} {}'.format(name, help_text))
+        lines.append('# TYPE {} counter'.format(name))
+        lines.append('{}{} {}'.format(name, label_str, snapshot[key]))
+    for key, help_text in _HISTOGRAMS:
+        name = '{}_{}_seconds'.format(prefix, key)
+        hist = snapshot[key]
+        lines.append('# HELP {} {}'.format(name, help_text))
+        lines.append('# TYPE {} histogram'.format(name))
+        cumulative = 0
+        for bound, count in zip(hist['buckets'], hist['counts']):
+            cumulative += count
+            lines.append('{}_bucket{} {}'.format(
+                name, _format_labels(dict(labels, le=repr(float(bound)))),
+                cumulative))
+        lines.append('{}_bucket{} {}'.format(
+            name, _format_labels(dict(labels, le='+Inf')), hist['count']))
+        lines.append('{}_sum{} {}'.format(name, label_str, hist['sum']))
+        lines.append('{}_count{} {}'.format(name, label_str, hist['count']))
+    return '\n'.join(lines) + '\n'
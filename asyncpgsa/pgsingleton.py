@@ -1,5 +1,19 @@
+import asyncio
+from functools import partial
+from time import perf_counter
+
+import asyncpg
+
+from .bufferedwriter import BufferedWriter
+from .cache import QueryCache, make_key, referenced_tables, written_tables
+from .connection import compile_query, compile_query_async
+from .deadline import effective_timeout
+from .listener import (Listener, TABLE_CHANGE_CHANNEL,
+                       tables_from_notifications)
 from .pool import create_pool
-from .connection import compile_query
+from .reflection import reflect
+from .retry import RetryStats, retry
+from .tracing import span
 """
 this is a high level singleton for managing a pool
 """
@@ -10,10 +24,14 @@ class NotInitializedError(Exception):
 
 
 class PG:
-    __slots__ = ('__pool',)
+    __slots__ = ('__pool', '__dialect', 'cache', 'listener', 'retry_stats')
 
-    def __init__(self):
+    def __init__(self, cache_size=1024):
         self.__pool = None
+        self.__dialect = None
+        self.cache = QueryCache(max_entries=cache_size)
+        self.listener = None
+        self.retry_stats = RetryStats()
 
     @property
     def pool(self):
@@ -31,12 +49,15 @@ class PG:
         """
         :param args: args for pool
         :param dialect: sqlalchemy postgres dialect
-        :param kwargs: kwargs for pool
+        :param kwargs: kwargs for pool, see `asyncpgsa.create_pool`
         :return: None
         """
         self.__pool = await create_pool(*args, dialect=dialect, **kwargs)
+        # create_pool may have adjusted it, e.g. for json_codecs
+        self.__dialect = self.__pool.dialect
 
-    def query(self, query, *args, prefetch=None, timeout=None):
+    def query(self, query, *args, prefetch=None, timeout=None, retries=0,
+              priority=None):
         """
         make a read only query. Ideal for select statements.
         This method converts the query to a prepared statement
@@ -60,42 +81,167 @@ class PG:
         :param int prefetch: The number of rows the *cursor iterator*
                              will prefetch (defaults to ``50``.)
         :param float timeout: Optional timeout in seconds.
+        :param int retries: times to retry the awaited query on
+                            serialization failures. The cursor runs in a
+                            deferrable transaction, which waits for a
+                            snapshot that cannot fail to serialize
+        :param priority: lane to acquire the connection in
         :return:
         """
-        compiled_q, compiled_args = compile_query(query)
+        start = perf_counter()
+        compiled_q, compiled_args = compile_query(query,
+                                                  dialect=self.__dialect)
         query, args = compiled_q, compiled_args or args
 
         return QueryContextManager(self.pool, query, args,
-                                   prefetch=prefetch, timeout=timeout)
-
-    async def fetch(self, query, *args, timeout=None):
-        async with self.pool.acquire() as conn:
-            return await conn.fetch(query, *args, timeout=timeout)
-
-    async def fetchrow(self, query, *args, timeout=None):
-        async with self.pool.acquire() as conn:
+                                   prefetch=prefetch, timeout=timeout,
+                                   retries=retries,
+                                   retry_stats=self.retry_stats,
+                                   compile_time=perf_counter() - start,
+                                   priority=priority)
+
+    async def fetch(self, query, *args, timeout=None, cache=None,
+                    priority=None):
+        """
+        :param float cache: if set, results are served from `self.cache`
+                            for up to this many seconds. Writes made to the
+                            same tables through this object drop them early.
+        :param priority: lane to acquire the connection in, see
+                         `asyncpgsa.admission.AdmissionControl`
+        """
+        if cache is None:
+            async with self.pool.acquire(priority=priority) as conn:
+                return await conn.fetch(query, *args, timeout=timeout)
+
+        compiled_q, compiled_args = await compile_query_async(
+            query, dialect=self.__dialect,
+            offloader=self.pool.compile_offloader)
+        args = compiled_args or args
+        key = make_key(compiled_q, args)
+        result = self.cache.get(key)
+        if result is None:
+            generation = self.cache.generation()
+            async with self.pool.acquire(priority=priority) as conn:
+                result = await conn.fetch(compiled_q, *args, timeout=timeout)
+            self.cache.set(key, result, cache, referenced_tables(query),
+                           generation=generation)
+        # a copy, so callers changing it do not change the cached result
+        return list(result)
+
+    async def gather(self, *queries, concurrency=None, snapshot=False,
+                     timeout=None, priority=None):
+        """
+        fetch independent queries concurrently, each connection taken from
+        the pool runs queries until none are left.
+
+        users, orders = await pg.gather(users_query, orders_query)
+
+        :param queries: statements or sql, or tuples of sql and its args
+        :param int concurrency: connections used at most, defaults to one
+                                per query up to the pool's max_size
+        :param bool snapshot: read every query from the same snapshot, in
+                              read only repeatable read transactions that
+                              share it via pg_export_snapshot. The
+                              connection exporting it runs whatever the
+                              others could not acquire a connection for
+        :param priority: lane to acquire the connections in
+        :return: a list of results as `fetch` returns them, in query order
+        """
+        queries = [q if isinstance(q, tuple) else (q,) for q in queries]
+        if not queries:
+            return []
+        results = [None] * len(queries)
+        workers = min(concurrency or len(queries), len(queries),
+                      self.pool.get_max_size())
+        # shared between the workers
+        pending = iter(range(len(queries)))
+
+        async def drain(conn):
+            for i in pending:
+                query, *args = queries[i]
+                results[i] = await conn.fetch(query, *args, timeout=timeout)
+
+        async def worker():
+            async with self.pool.acquire(priority=priority) as conn:
+                await drain(conn)
+
+        if not snapshot:
+            await _gather(*(worker() for _ in range(workers)))
+            return results
+
+        # followers still waiting for a connection
+        waiting = set()
+
+        async def follower(snapshot_id):
+            task = asyncio.current_task()
+            waiting.add(task)
+            try:
+                conn = await self.pool.acquire(priority=priority)
+            except asyncio.CancelledError:
+                if task in waiting:
+                    raise
+                # cancelled by lead(), there is nothing left to do
+                return
+            waiting.discard(task)
+            try:
+                async with conn.transaction(isolation='repeatable_read',
+                                            readonly=True):
+                    await conn.execute(
+                        "SET TRANSACTION SNAPSHOT '{}'".format(snapshot_id))
+                    await drain(conn)
+            finally:
+                await self.pool.release(conn)
+
+        async def lead(conn):
+            await drain(conn)
+            # every query is taken. Waiting for a connection now, while
+            # holding this one, could deadlock with other callers holding
+            # the rest of the pool
+            for task in waiting:
+                task.cancel()
+            waiting.clear()
+
+        async with self.pool.acquire(priority=priority) as conn:
+            async with conn.transaction(isolation='repeatable_read',
+                                        readonly=True):
+                snapshot_id = await conn.fetchval(
+                    'SELECT pg_export_snapshot()')
+                # the snapshot is only valid while this transaction is open
+                await _gather(lead(conn), *(follower(snapshot_id)
+                                            for _ in range(workers - 1)))
+        return results
+
+    async def fetchrow(self, query, *args, timeout=None, priority=None):
+        async with self.pool.acquire(priority=priority) as conn:
             return await conn.fetchrow(query, *args, timeout=timeout)
 
-    async def fetchval(self, query, *args, timeout=None, column=0):
-        async with self.pool.acquire() as conn:
+    async def fetchval(self, query, *args, timeout=None, column=0,
+                       priority=None):
+        async with self.pool.acquire(priority=priority) as conn:
             return await conn.fetchval(
                 query, *args, column=column, timeout=timeout)
 
-    async def execute(self, *args, **kwargs):
-        async with self.pool.acquire() as conn:
-            return await conn.execute(*args, **kwargs)
+    async def execute(self, *args, priority=None, **kwargs):
+        async with self.pool.acquire(priority=priority) as conn:
+            result = await conn.execute(*args, **kwargs)
+        if args:
+            self.cache.invalidate(written_tables(args[0]))
+        return result
 
     async def insert(self, *args, id_col_name: str = 'id',
-                     timeout=None):
-        async with self.pool.acquire() as conn:
-            return await conn.insert(
+                     timeout=None, priority=None):
+        async with self.pool.acquire(priority=priority) as conn:
+            result = await conn.insert(
                 *args,
                 id_col_name=id_col_name,
                 timeout=timeout)
+        if args:
+            self.cache.invalidate(written_tables(args[0]))
+        return result
 
     def transaction(self, **kwargs):
         # not async because this returns a context manager
-        return self.pool.transaction(**kwargs)
+        return self.pool.transaction(cache=self.cache, **kwargs)
 
     def begin(self, **kwargs):
         """
@@ -103,19 +249,140 @@ class PG:
         """
         return self.transaction(**kwargs)
 
+    def stats(self):
+        """
+        per statement timings, slowest total time first.
+        Needs `pg.init(..., statement_stats=True)`
+        """
+        stats = self.pool.statement_stats
+        return stats.snapshot() if stats is not None else []
+
+    def reset_stats(self):
+        if self.pool.statement_stats is not None:
+            self.pool.statement_stats.reset()
+
+    async def reflect(self, metadata=None, **kwargs):
+        """
+        load tables from the database on one pool connection,
+        see `asyncpgsa.reflection.reflect` for the kwargs
+        """
+        async with self.pool.acquire() as conn:
+            return await reflect(conn, metadata, dialect=self.__dialect,
+                                 **kwargs)
+
+    async def run_in_transaction(self, fn, *args, isolation='serializable',
+                                 retries=3, backoff=0.01, max_backoff=1.0,
+                                 **kwargs):
+        """
+        run `await fn(conn, *args)` in a transaction, and run it again in a
+        new transaction if it fails with a serialization failure or a
+        deadlock. The connection is released between attempts.
+        Retries are counted in `self.retry_stats`.
+
+        :param fn: coroutine function, gets the connection as first argument
+        :param isolation: transaction isolation level
+        :param int retries: retries after the first attempt
+        :param float backoff: base delay in seconds, doubled for each retry
+                              and jittered
+        :param float max_backoff: max delay in seconds
+        :param kwargs: other transaction kwargs
+        :return: whatever fn returns
+        """
+        async def attempt():
+            async with self.transaction(isolation=isolation, **kwargs) as conn:
+                return await fn(conn, *args)
+
+        return await retry(attempt, retries=retries, backoff=backoff,
+                           max_backoff=max_backoff, stats=self.retry_stats)
+
+    def buffered_writer(self, table, max_rows=1000, max_delay=1.0, **kwargs):
+        """
+        a `BufferedWriter` that inserts rows into `table` in bulk.
+        Call `close` (or use `async with`) to flush on shutdown.
+
+        :param table: sqlalchemy Table
+        :param int max_rows: buffered rows that trigger a flush
+        :param float max_delay: seconds a row may wait before a flush
+        :param kwargs: see `BufferedWriter`
+        """
+        return BufferedWriter(self.pool, table, max_rows=max_rows,
+                              max_delay=max_delay, dialect=self.__dialect,
+                              **kwargs)
+
+    async def listen(self, channel, handler, *, connect=None, dsn=None,
+                     **kwargs):
+        """
+        call `handler` with batches of notifications sent to `channel`.
+        All channels share one dedicated connection which is not part
+        of the pool, and which reconnects automatically.
+        PgBouncer in transaction pooling mode does not deliver
+        notifications, so behind it pass the `dsn` of the server itself.
+
+        :param channel: channel name
+        :param handler: coroutine function taking a list of `Notification`
+        :param connect: coroutine function returning the connection to
+                        listen on, by default a new one like the pool's
+        :param dsn: listen on a connection to this dsn instead
+        :param kwargs: options for the `Listener`
+        `connect`, `dsn` and `kwargs` are only used by the first call
+        """
+        if self.listener is None:
+            if connect is None:
+                connect = self.pool.new_connection if dsn is None \
+                    else partial(asyncpg.connect, dsn)
+            self.listener = Listener(connect, **kwargs)
+        await self.listener.add(channel, handler)
+
+    async def unlisten(self, channel, handler):
+        if self.listener is not None:
+            await self.listener.remove(channel, handler)
+
+    async def listen_cache_invalidations(self, channel=TABLE_CHANGE_CHANNEL):
+        """
+        invalidate `self.cache` from notifications sent by
+        `asyncpgsa.listener.table_change_trigger`, so writes from other
+        processes drop cached results too.
+        """
+        async def invalidate(notifications):
+            self.cache.invalidate(tables_from_notifications(notifications))
+
+        await self.listen(channel, invalidate)
+        self.listener.on_reconnect = self.cache.clear
+
+
+async def _gather(*coros):
+    """
+    like asyncio.gather, but cancels and awaits the others when one fails,
+    so no query is still running on a connection being released
+    """
+    tasks = [asyncio.ensure_future(coro) for coro in coros]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
 
 class QueryContextManager:
     __slots__ = ('pool', 'query', 'args', 'prefetch', 'timeout', 'cursor',
+                 'retries', 'retry_stats', 'compile_time', 'priority',
                  '_con')
 
     def __init__(self, pool, query, args=None,
-                 prefetch=None, timeout=None):
+                 prefetch=None, timeout=None, retries=0, retry_stats=None,
+                 compile_time=0.0, priority=None):
         self.pool = pool
         self.cursor = None
         self.query = query
         self.args = args
         self.prefetch = prefetch
         self.timeout = timeout
+        self.retries = retries
+        self.retry_stats = retry_stats
+        self.compile_time = compile_time
+        self.priority = priority
         self._con = None
 
     def __enter__(self):
@@ -125,25 +392,74 @@ class QueryContextManager:
         pass
 
     async def __aenter__(self):
+        # rows are read after __aenter__ returns, where a retry cannot
+        # reach, so wait for a safe snapshot instead
         self._con = self.pool.transaction(readonly=True,
-                                            isolation='serializable')
+                                          isolation='serializable',
+                                          deferrable=True,
+                                          priority=self.priority)
         con = await self._con.__aenter__()
-        ps = await con.prepare(self.query, timeout=self.timeout)
-        self.cursor = ps.cursor(*self.args, prefetch=self.prefetch,
-                                timeout=self.timeout)
+        try:
+            with span('asyncpgsa.query') as s:
+                s.set('db.statement', self.query)
+                s.set('asyncpgsa.cursor', True)
+                if self.__pgbouncer_mode:
+                    self.cursor = con.cursor(self.query, *self.args,
+                                             prefetch=self.prefetch,
+                                             timeout=self.timeout)
+                else:
+                    ps = await con.prepare(self.query, timeout=self.timeout)
+                    self.cursor = ps.cursor(
+                        *self.args, prefetch=self.prefetch,
+                        timeout=effective_timeout(self.timeout))
+        except BaseException as e:
+            await self._con.__aexit__(type(e), e, e.__traceback__)
+            raise
+        stats = getattr(self.pool, 'statement_stats', None)
+        if stats is not None:
+            # rows are streamed later, so this is not timed as a call
+            stats.record_compile(self.query, self.compile_time)
         return CursorInterface(self.cursor)
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         await self._con.__aexit__(exc_type, exc_val, exc_tb)
 
     async def __run_query(self):
-        async with self.pool.acquire() as con:
-            ps = await con.prepare(self.query, timeout=self.timeout)
-            result = await ps.fetch(*self.args, timeout=self.timeout)
+        async with self.pool.acquire(priority=self.priority) as con:
+            start = perf_counter()
+            with span('asyncpgsa.query') as s:
+                s.set('db.statement', self.query)
+                if self.__pgbouncer_mode:
+                    # unnamed statement, the connection records the call
+                    # but the statement was compiled here
+                    stats = getattr(self.pool, 'statement_stats', None)
+                    if stats is not None:
+                        stats.record_compile(self.query, self.compile_time)
+                    return await con.fetch(self.query, *self.args,
+                                           timeout=self.timeout)
+                ps = await con.prepare(self.query, timeout=self.timeout)
+                result = await ps.fetch(
+                    *self.args, timeout=effective_timeout(self.timeout))
+                s.set('db.rows', len(result))
+            self.__record(perf_counter() - start, len(result))
             return result
 
+    @property
+    def __pgbouncer_mode(self):
+        return getattr(self.pool, 'pgbouncer_mode', False)
+
+    def __record(self, execute_time, rows):
+        stats = getattr(self.pool, 'statement_stats', None)
+        if stats is not None:
+            stats.record(self.query, self.compile_time, execute_time, rows)
+        slow_query_log = getattr(self.pool, 'slow_query_log', None)
+        if slow_query_log is not None:
+            slow_query_log.record(self.query, self.args,
+                                  self.compile_time + execute_time)
+
     def __await__(self):
-        return self.__run_query().__await__()
+        return retry(self.__run_query, retries=self.retries,
+                     stats=self.retry_stats).__await__()
 
 
 class CursorIterator:
@@ -1,31 +1,311 @@
-from functools import wraps
+import asyncio
+import copy
+import inspect
+import time
+from functools import partial
 
 import asyncpg
 
+from .autoscale import PoolAutoscaler
+from .deadline import effective_timeout, no_deadline
+from .maintenance import PoolMaintainer
+from .metrics import PoolMetrics
+from .slowlog import SlowQueryLog
+from .stats import StatementCacheStats, StatementStatsTable
+from .tracing import span
 from .transactionmanager import ConnectionTransactionContextManager
-from .connection import SAConnection as _SAConnection
+from .warmup import StatementRegistry
+from .connection import SAConnection as _SAConnection, CompileOffloader
+from .connection import get_dialect
+from .jsoncodecs import passthrough, register_json_codecs
+from .typecodecs import TypeCodecs
+
+# pool options asyncpg.create_pool defaults, Pool itself requires them all
+_POOL_DEFAULTS = {
+    name: param.default
+    for name, param in inspect.signature(
+        asyncpg.create_pool).parameters.items()
+    if param.kind is param.KEYWORD_ONLY
+}
+
+
+class SAPool(asyncpg.pool.Pool):
+    """
+    asyncpg pool with transaction helpers and usage metrics,
+    see `PoolMetrics`
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.metrics = PoolMetrics(self)
+        self.statement_stats = None
+        self.slow_query_log = None
+        self.compile_offloader = None
+        self.statement_registry = None
+        self.statement_cache_stats = None
+        self.pgbouncer_mode = False
+        self.autoscaler = None
+        self.admission = None
+        self.maintainer = None
+        self.dialect = None
+        self.type_codecs = None
+        # coroutine function opening a connection like the pool's,
+        # which is not part of the pool, see `create_pool`
+        self.new_connection = None
+        self._hold_started = {}
+        self._lanes = {}
+
+    async def _async__init__(self):
+        await super()._async__init__()
+        if self.autoscaler is not None:
+            self.autoscaler.start()
+        if self.maintainer is not None:
+            self.maintainer.start()
+        return self
+
+    def transaction(self, **kwargs):
+        return ConnectionTransactionContextManager(self, **kwargs)
+
+    begin = transaction
+
+    def acquire(self, *, timeout=None, priority=None):
+        """
+        :param priority: lane to queue in, see `AdmissionControl`
+        """
+        return _AcquireContext(self, timeout, priority)
+
+    async def _acquire(self, timeout, priority=None):
+        timeout = effective_timeout(timeout)
+        metrics = self.metrics
+        metrics.waiters += 1
+        start = time.monotonic()
+        lane = None
+        try:
+            with span('asyncpgsa.acquire'):
+                if self.admission is not None:
+                    lane = await self.admission.admit(priority, timeout)
+                    if timeout is not None:
+                        timeout = max(timeout - (time.monotonic() - start),
+                                      0)
+                proxy = await super()._acquire(timeout)
+        except BaseException as e:
+            if lane is not None:
+                self.admission.release(lane)
+            if isinstance(e, asyncio.TimeoutError):
+                metrics.timeouts += 1
+            raise
+        finally:
+            metrics.waiters -= 1
+
+        now = time.monotonic()
+        metrics.acquire_wait.observe(now - start)
+        metrics.acquires += 1
+        metrics.in_use += 1
+        self._hold_started[proxy] = now
+        if lane is not None:
+            self._lanes[proxy] = lane
+        return proxy
+
+    async def release(self, connection, *, timeout=None):
+        started = self._hold_started.pop(connection, None)
+        if started is not None:
+            self.metrics.in_use -= 1
+            self.metrics.hold_time.observe(time.monotonic() - started)
+        try:
+            # resetting the connection is not part of the caller's work
+            with no_deadline():
+                return await super().release(connection, timeout=timeout)
+        finally:
+            lane = self._lanes.pop(connection, None)
+            if lane is not None:
+                self.admission.release(lane)
+
+    async def close(self):
+        if self.maintainer is not None:
+            await self.maintainer.stop()
+        if self.autoscaler is not None:
+            await self.autoscaler.stop()
+        if self.statement_registry is not None:
+            self.statement_registry.save()
+        await super().close()
+
+
+class _AcquireContext(asyncpg.pool.PoolAcquireContext):
+    __slots__ = ('priority',)
+
+    def __init__(self, pool, timeout, priority):
+        super().__init__(pool, timeout)
+        self.priority = priority
+
+    async def __aenter__(self):
+        if self.connection is not None or self.done:
+            raise asyncpg.InterfaceError('a connection is already acquired')
+        self.connection = await self.pool._acquire(self.timeout,
+                                                   self.priority)
+        return self.connection
+
+    def __await__(self):
+        self.done = True
+        return self.pool._acquire(self.timeout, self.priority).__await__()
+
+
+def _connection_factory(args, connect_kwargs, connection_class):
+    accepted = inspect.signature(asyncpg.connect).parameters
+    options = {name: value for name, value in connect_kwargs.items()
+               if name in accepted}
+    return partial(asyncpg.connect, *args, connection_class=connection_class,
+                   **options)
+
+
+def _chain_init(init, hook):
+    async def chained_init(conn):
+        if init is not None:
+            await init(conn)
+        await hook(conn)
+    return chained_init
+
+
+def _json_codecs_dialect(dialect):
+    """
+    :return: the dialect to compile with once asyncpg encodes json,
+             and the codec functions matching its json settings
+    """
+    if dialect is None:
+        return get_dialect(json_serializer=passthrough), None, None
+    dumps = dialect._json_serializer
+    loads = dialect._json_deserializer
+    dialect = copy.copy(dialect)
+    dialect._json_serializer = passthrough
+    return dialect, dumps, loads
 
 
-@wraps(asyncpg.create_pool)
 def create_pool(*args,
                 dialect=None,
                 connection_class=_SAConnection,
+                pool_class=SAPool,
+                statement_stats=False,
+                slow_query_log=None,
+                compile_offloader=None,
+                statement_registry=None,
+                statement_cache_stats=None,
+                pgbouncer_mode=False,
+                autoscale=None,
+                admission=None,
+                maintenance=None,
+                json_codecs=False,
+                metadata=None,
                 **connect_kwargs):
+    """
+    create a `SAPool`, other arguments are passed to `asyncpg.create_pool`
+
+    :param statement_stats: True (or a `StatementStatsTable`) to time every
+                            statement, see `pool.statement_stats`
+    :param slow_query_log: a `SlowQueryLog`, or a threshold in seconds
+                           to create one with, see `pool.slow_query_log`
+    :param compile_offloader: True (or a `CompileOffloader`) to compile
+                              statements that are slow to compile in a
+                              thread instead of on the event loop
+    :param statement_registry: True (or a `StatementRegistry`) to prepare
+                               hot statements on every new connection,
+                               see `pool.statement_registry`
+    :param statement_cache_stats: True (or a `StatementCacheStats`) to
+                                  watch the statement cache for thrashing,
+                                  see `pool.statement_cache_stats`
+    :param pgbouncer_mode: only use unnamed statements, for PgBouncer in
+                           transaction pooling mode. Disables the statement
+                           cache, and cursors use DECLARE/FETCH
+    :param autoscale: True (or a `PoolAutoscaler`) to resize the pool
+                      between min_size and max_size from acquire latency,
+                      see `pool.autoscaler`
+    :param admission: an `AdmissionControl` with priority lanes for
+                      `pool.acquire(priority=...)`
+    :param maintenance: True (or a `PoolMaintainer`) to probe and recycle
+                        idle connections in the background
+    :param json_codecs: let asyncpg encode and decode json and jsonb
+                        (with orjson when installed) instead of sqlalchemy,
+                        so values are serialized once and json columns
+                        are read as python objects
+    :param metadata: sqlalchemy MetaData, codecs are registered for the
+                     enums (with an enum class) and `CompositeType`s its
+                     columns use, see `pool.type_codecs`
+    """
+    if statement_stats is True:
+        statement_stats = StatementStatsTable()
+    elif statement_stats is False:
+        statement_stats = None
+    if isinstance(slow_query_log, (int, float)):
+        slow_query_log = SlowQueryLog(threshold=slow_query_log)
+    if compile_offloader is True:
+        compile_offloader = CompileOffloader()
+    if statement_registry is True:
+        statement_registry = StatementRegistry()
+    if pgbouncer_mode:
+        if statement_registry:
+            raise ValueError('statement_registry needs the statement cache, '
+                             'which pgbouncer_mode disables')
+        connect_kwargs['statement_cache_size'] = 0
+    if autoscale is True:
+        autoscale = PoolAutoscaler()
+    if maintenance is True:
+        maintenance = PoolMaintainer()
+    if statement_cache_stats is True:
+        statement_cache_stats = StatementCacheStats()
+    if json_codecs:
+        dialect, dumps, loads = _json_codecs_dialect(dialect)
+
+        async def json_init(conn):
+            await register_json_codecs(conn, dumps=dumps, loads=loads)
+        connect_kwargs['init'] = _chain_init(connect_kwargs.get('init'),
+                                             json_init)
+    type_codecs = None
+    if metadata is not None:
+        type_codecs = TypeCodecs(metadata, dialect)
+        connect_kwargs['init'] = _chain_init(connect_kwargs.get('init'),
+                                             type_codecs.register)
+    if statement_registry is not None:
+        connect_kwargs['init'] = _chain_init(connect_kwargs.get('init'),
+                                             statement_registry.warm)
+
+    connection_options = {
+        'dialect': dialect,
+        'statement_stats': statement_stats,
+        'slow_query_log': slow_query_log,
+        'compile_offloader': compile_offloader,
+        'statement_registry': statement_registry,
+        'statement_cache_stats': statement_cache_stats,
+        'pgbouncer_mode': pgbouncer_mode,
+    }
 
     class SAConnection(connection_class):
-        def __init__(self, *args, dialect=dialect, **kwargs):
-            super().__init__(*args, dialect=dialect, **kwargs)
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **dict(connection_options, **kwargs))
 
     connection_class = SAConnection
 
-    # dict is fine on the pool object as there is usually only one of them
-    # asyncpg.pool.Pool.__slots__ += ('__dict__',)
-
-    # monkey patch pool to have some extra methods
-    def transaction(self, **kwargs):
-        return ConnectionTransactionContextManager(self, **kwargs)
-    asyncpg.pool.Pool.transaction = transaction
-    asyncpg.pool.Pool.begin = transaction
-    pool = asyncpg.create_pool(*args, connection_class=connection_class,
-                               **connect_kwargs)
+    kwargs = dict(_POOL_DEFAULTS)
+    kwargs.update(connect_kwargs, connection_class=connection_class)
+    pool = pool_class(*args, **kwargs)
+    pool.new_connection = _connection_factory(args, connect_kwargs,
+                                              connection_class)
+    pool.statement_stats = statement_stats
+    pool.slow_query_log = slow_query_log
+    pool.compile_offloader = compile_offloader
+    pool.statement_registry = statement_registry
+    pool.statement_cache_stats = statement_cache_stats
+    pool.pgbouncer_mode = pgbouncer_mode
+    pool.autoscaler = autoscale
+    pool.admission = admission
+    pool.dialect = dialect
+    pool.type_codecs = type_codecs
+    pool.maintainer = maintenance
+    if maintenance is not None:
+        maintenance.pool = pool
+    if admission is not None:
+        admission.pool = pool
+    if autoscale is not None:
+        autoscale.pool = pool
+    if statement_cache_stats is not None:
+        statement_cache_stats.pool = pool
+    if slow_query_log is not None:
+        slow_query_log.pool = pool
     return pool
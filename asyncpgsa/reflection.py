@@ -0,0 +1,381 @@
+"""
+table reflection over asyncpg, with an on-disk catalog cache
+"""
+
+import inspect
+import json
+import os
+import re
+from functools import lru_cache
+
+from sqlalchemy import (CheckConstraint, Column, ForeignKeyConstraint, Index,
+                        MetaData, Table,
+                        UniqueConstraint, schema as sa_schema, text)
+from sqlalchemy.exc import NoSuchTableError
+
+from .connection import default_dialect
+
+
+CACHE_VERSION = 1
+
+COLUMNS_QUERY = """
+SELECT c.relname AS "table",
+    obj_description(c.oid, 'pg_class') AS "table_comment",
+    a.attname AS "name", format_type(a.atttypid, a.atttypmod) AS "type",
+    pg_get_expr(d.adbin, d.adrelid) AS "default", a.attnotnull AS "notnull",
+    col_description(c.oid, a.attnum) AS "comment", {generated} AS "generated"
+FROM pg_attribute a
+JOIN pg_class c ON c.oid = a.attrelid
+JOIN pg_namespace n ON n.oid = c.relnamespace
+LEFT JOIN pg_attrdef d ON d.adrelid = a.attrelid AND d.adnum = a.attnum
+WHERE n.nspname = coalesce($1, current_schema())
+AND c.relkind::text = ANY($2::text[])
+AND a.attnum > 0 AND NOT a.attisdropped
+ORDER BY c.relname, a.attnum
+"""
+
+_ATTNAMES = """ARRAY(
+    SELECT a.attname FROM unnest({keys}) WITH ORDINALITY AS u(attnum, i)
+    JOIN pg_attribute a ON a.attrelid = {rel} AND a.attnum = u.attnum
+    ORDER BY u.i)"""
+
+CONSTRAINTS_QUERY = """
+SELECT c.relname AS "table", k.conname AS "name", k.contype AS "type",
+    {columns} AS "columns",
+    rn.nspname AS "referred_schema", r.relname AS "referred_table",
+    {referred_columns} AS "referred_columns",
+    k.condeferrable AS "deferrable", k.condeferred AS "deferred",
+    pg_get_constraintdef(k.oid) AS "definition"
+FROM pg_constraint k
+JOIN pg_class c ON c.oid = k.conrelid
+JOIN pg_namespace n ON n.oid = c.relnamespace
+LEFT JOIN pg_class r ON r.oid = k.confrelid
+LEFT JOIN pg_namespace rn ON rn.oid = r.relnamespace
+WHERE n.nspname = coalesce($1, current_schema())
+AND c.relkind::text = ANY($2::text[])
+AND k.contype IN ('p', 'f', 'u', 'c')
+ORDER BY c.relname, k.conname
+""".format(columns=_ATTNAMES.format(keys='k.conkey', rel='k.conrelid'),
+           referred_columns=_ATTNAMES.format(keys='k.confkey',
+                                             rel='k.confrelid'))
+
+INDEXES_QUERY = """
+SELECT c.relname AS "table", i.relname AS "name", x.indisunique AS "unique",
+    {columns} AS "columns", am.amname AS "using",
+    pg_get_expr(x.indpred, x.indrelid) AS "where"
+FROM pg_index x
+JOIN pg_class c ON c.oid = x.indrelid
+JOIN pg_class i ON i.oid = x.indexrelid
+JOIN pg_am am ON am.oid = i.relam
+JOIN pg_namespace n ON n.oid = c.relnamespace
+WHERE n.nspname = coalesce($1, current_schema())
+AND c.relkind::text = ANY($2::text[])
+AND x.indexprs IS NULL
+AND NOT EXISTS (SELECT 1 FROM pg_constraint k WHERE k.conindid = x.indexrelid)
+ORDER BY c.relname, i.relname
+""".format(columns=_ATTNAMES.format(keys='x.indkey::int2[]',
+                                    rel='x.indrelid'))
+
+ENUMS_QUERY = """
+SELECT t.typname AS "name", n.nspname AS "schema",
+    pg_type_is_visible(t.oid) AS "visible",
+    array_agg(e.enumlabel ORDER BY e.enumsortorder) AS "labels"
+FROM pg_type t
+JOIN pg_namespace n ON n.oid = t.typnamespace
+JOIN pg_enum e ON e.enumtypid = t.oid
+GROUP BY t.oid, n.nspname
+"""
+
+DOMAINS_QUERY = """
+SELECT t.typname AS "name", n.nspname AS "schema",
+    pg_type_is_visible(t.oid) AS "visible",
+    format_type(t.typbasetype, t.typtypmod) AS "type",
+    NOT t.typnotnull AS "nullable", t.typdefault AS "default"
+FROM pg_type t
+JOIN pg_namespace n ON n.oid = t.typnamespace
+WHERE t.typtype = 'd'
+"""
+
+# everything the catalog queries read, hashed on the server so a warm
+# start costs one round trip
+FINGERPRINT_QUERY = """
+SELECT md5(coalesce(string_agg(x, E'\\n' ORDER BY x), ''))
+FROM (
+    SELECT concat_ws(' ', c.relname, obj_description(c.oid, 'pg_class'),
+        a.attname, format_type(a.atttypid, a.atttypmod),
+        pg_get_expr(d.adbin, d.adrelid), a.attnotnull,
+        col_description(c.oid, a.attnum), {generated})
+    FROM pg_attribute a
+    JOIN pg_class c ON c.oid = a.attrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    LEFT JOIN pg_attrdef d ON d.adrelid = a.attrelid AND d.adnum = a.attnum
+    WHERE n.nspname = coalesce($1, current_schema())
+    AND c.relkind::text = ANY($2::text[])
+    AND a.attnum > 0 AND NOT a.attisdropped
+    UNION ALL
+    SELECT concat_ws(' ', c.relname, k.conname, pg_get_constraintdef(k.oid))
+    FROM pg_constraint k
+    JOIN pg_class c ON c.oid = k.conrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE n.nspname = coalesce($1, current_schema())
+    AND c.relkind::text = ANY($2::text[])
+    UNION ALL
+    SELECT pg_get_indexdef(x.indexrelid)
+    FROM pg_index x
+    JOIN pg_class c ON c.oid = x.indrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE n.nspname = coalesce($1, current_schema())
+    AND c.relkind::text = ANY($2::text[])
+    UNION ALL
+    SELECT concat_ws(' ', n.nspname, t.typname, t.typtype,
+        format_type(t.typbasetype, t.typtypmod), t.typnotnull, t.typdefault,
+        (SELECT string_agg(e.enumlabel, ',' ORDER BY e.enumsortorder)
+         FROM pg_enum e WHERE e.enumtypid = t.oid))
+    FROM pg_type t
+    JOIN pg_namespace n ON n.oid = t.typnamespace
+    WHERE t.typtype IN ('e', 'd')
+) s(x)
+"""
+
+_FK_ACTIONS = re.compile(
+    r'ON (UPDATE|DELETE) (CASCADE|RESTRICT|NO ACTION|SET NULL|SET DEFAULT)')
+_FK_MATCH = re.compile(r'MATCH (FULL|PARTIAL|SIMPLE)')
+_CHECK = re.compile(r'^CHECK *\((.+)\)( NOT VALID)?$', re.DOTALL)
+
+
+async def reflect(conn, metadata=None, *, schema=None, only=None,
+                  views=False, cache=None, dialect=None):
+    """
+    Load the tables of `schema` into `metadata`, like MetaData.reflect but
+    over an asyncpg connection and with a few catalog queries for the
+    whole schema instead of several per table.
+
+    With `cache` set the catalog is kept in that file together with a
+    fingerprint of the schema, and as long as the fingerprint matches
+    the catalog queries are skipped.
+
+    metadata = await reflect(conn, cache='/var/cache/app/schema.json')
+    users = metadata.tables['users']
+
+    :param conn: asyncpg connection
+    :param metadata: MetaData to add the tables to, a new one by default
+    :param str schema: schema name, the current schema by default
+    :param only: table names to load, tables they refer to in the same
+                 schema are loaded too. All tables by default
+    :param bool views: load views and materialized views too
+    :param str cache: path of a json file to keep the catalog in
+    :param dialect: sqlalchemy postgres dialect used to map type names
+    :return: the metadata
+    """
+    if metadata is None:
+        metadata = MetaData()
+    kinds = ['r', 'p', 'v', 'm'] if views else ['r', 'p']
+    generated = 'a.attgenerated' if conn.get_server_version() >= (12,) \
+        else "''"
+
+    catalog = None
+    if cache is not None:
+        fingerprint = await conn.fetchval(
+            FINGERPRINT_QUERY.format(generated=generated), schema, kinds)
+        key = [CACHE_VERSION, schema, kinds, fingerprint]
+        catalog = _load(cache, key)
+    if catalog is None:
+        catalog = await _load_catalog(conn, schema, kinds, generated)
+        if cache is not None:
+            _save(cache, key, catalog)
+
+    build_tables(catalog, metadata, schema=schema, only=only,
+                 dialect=dialect)
+    return metadata
+
+
+async def _load_catalog(conn, schema, kinds, generated):
+    tables = {}
+    for row in await conn.fetch(COLUMNS_QUERY.format(generated=generated),
+                                schema, kinds):
+        table = tables.get(row['table'])
+        if table is None:
+            table = tables[row['table']] = {
+                'comment': row['table_comment'], 'columns': [],
+                'constraints': [], 'indexes': []}
+        column = dict(row)
+        del column['table'], column['table_comment']
+        column['generated'] = _char(column['generated'])
+        table['columns'].append(column)
+
+    for row in await conn.fetch(CONSTRAINTS_QUERY, schema, kinds):
+        constraint = dict(row, type=_char(row['type']))
+        tables[constraint.pop('table')]['constraints'].append(constraint)
+
+    for row in await conn.fetch(INDEXES_QUERY, schema, kinds):
+        index = dict(row)
+        tables[index.pop('table')]['indexes'].append(index)
+
+    return {
+        'schema': await conn.fetchval('SELECT coalesce($1, current_schema())',
+                                      schema),
+        'tables': tables,
+        'enums': [dict(row) for row in await conn.fetch(ENUMS_QUERY)],
+        'domains': [dict(row) for row in await conn.fetch(DOMAINS_QUERY)],
+    }
+
+
+def build_tables(catalog, metadata, *, schema=None, only=None,
+                 dialect=None):
+    """
+    create `Table`s in `metadata` from a catalog loaded by `reflect`
+    """
+    dialect = dialect or default_dialect()
+    tables = catalog['tables']
+    names = list(tables) if only is None else _with_referred(
+        tables, only, catalog['schema'])
+    enums = {_type_key(enum): enum for enum in catalog['enums']}
+    domains = {_type_key(domain): {
+        # strip (30) from character varying(30), like sqlalchemy
+        'attype': re.search(r'([^(]+)', domain['type']).group(1),
+        'nullable': domain['nullable'],
+        'default': domain['default'],
+    } for domain in catalog['domains']}
+
+    for name in names:
+        if _table_key(name, schema) in metadata.tables:
+            continue
+        table = tables[name]
+        columns = [_column(dialect, column, domains, enums, schema)
+                   for column in table['columns']]
+        constraints = [_constraint(c, schema, catalog['schema'])
+                       for c in table['constraints'] if c['type'] != 'p']
+        sa_table = Table(name, metadata, *columns,
+                         *(c for c in constraints if c is not None),
+                         *(_index(index) for index in table['indexes']),
+                         schema=schema, comment=table['comment'])
+        for constraint in table['constraints']:
+            if constraint['type'] == 'p':
+                # like sqlalchemy, to keep the key's column order
+                sa_table.primary_key.name = constraint['name']
+                sa_table.primary_key._reload(
+                    [sa_table.c[c] for c in constraint['columns']])
+    return metadata
+
+
+def _column(dialect, column, domains, enums, schema):
+    args = [column['name'], column['type'], column['default'],
+            column['notnull'], domains, enums, schema, column['comment'],
+            column['generated']]
+    if _takes_identity(type(dialect)):
+        # sqlalchemy 1.4, identity options are not loaded so identity
+        # columns are reflected as plain columns
+        args.append(None)
+    info = dialect._get_column_info(*args)
+    args = []
+    if info.get('default') is not None:
+        args.append(sa_schema.DefaultClause(text(info['default']),
+                                            _reflected=True))
+    if 'computed' in info:
+        args.append(sa_schema.Computed(**info['computed']))
+    return Column(info['name'], info['type'], *args,
+                  nullable=info['nullable'],
+                  autoincrement=info['autoincrement'],
+                  comment=info['comment'])
+
+
+def _constraint(constraint, schema, current_schema):
+    kind = constraint['type']
+    name = constraint['name']
+    columns = constraint['columns']
+    if kind == 'u':
+        return UniqueConstraint(*columns, name=name)
+    if kind == 'c':
+        match = _CHECK.match(constraint['definition'])
+        if match is None:
+            return None
+        return CheckConstraint(match.group(1), name=name)
+
+    referred = constraint['referred_table']
+    referred_schema = constraint['referred_schema']
+    if referred_schema == current_schema:
+        referred_schema = schema
+    if referred_schema is not None:
+        referred = referred_schema + '.' + referred
+    options = {'onupdate': None, 'ondelete': None}
+    for event, action in _FK_ACTIONS.findall(constraint['definition']):
+        options['on' + event.lower()] = action
+    match = _FK_MATCH.search(constraint['definition'])
+    return ForeignKeyConstraint(
+        columns, [referred + '.' + c for c in constraint['referred_columns']],
+        name=name, link_to_name=True,
+        deferrable=constraint['deferrable'] or None,
+        initially='DEFERRED' if constraint['deferred'] else None,
+        match=match.group(1) if match else None, **options)
+
+
+def _index(index):
+    kwargs = {}
+    if index['using'] != 'btree':
+        kwargs['postgresql_using'] = index['using']
+    if index['where'] is not None:
+        kwargs['postgresql_where'] = text(index['where'])
+    return Index(index['name'], *index['columns'], unique=index['unique'],
+                 **kwargs)
+
+
+@lru_cache()
+def _takes_identity(dialect_class):
+    try:
+        get_column_info = dialect_class._get_column_info
+    except AttributeError:
+        raise NotImplementedError(
+            'reflect supports the postgres dialect of sqlalchemy 1.3 '
+            'and 1.4 only')
+    return 'identity' in inspect.signature(get_column_info).parameters
+
+
+def _with_referred(tables, only, current_schema):
+    names = []
+    pending = list(only)
+    while pending:
+        name = pending.pop()
+        if name in names:
+            continue
+        if name not in tables:
+            raise NoSuchTableError(name)
+        names.append(name)
+        for constraint in tables[name]['constraints']:
+            if constraint['type'] == 'f' \
+                    and constraint['referred_schema'] == current_schema:
+                pending.append(constraint['referred_table'])
+    return names
+
+
+def _table_key(name, schema):
+    return name if schema is None else schema + '.' + name
+
+
+def _type_key(type_):
+    # how sqlalchemy looks enums and domains up by their format_type name
+    if type_['visible']:
+        return (type_['name'],)
+    return (type_['schema'], type_['name'])
+
+
+def _char(value):
+    # asyncpg reads "char" as bytes, and the empty one as a zero byte
+    return value.decode().strip('\x00')
+
+
+def _load(path, key):
+    try:
+        with open(path) as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if cached.get('key') != key:
+        return None
+    return cached['catalog']
+
+
+def _save(path, key, catalog):
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump({'key': key, 'catalog': catalog}, f)
+    os.replace(tmp, path)
@@ -0,0 +1,68 @@
+"""
+retrying of transactions that failed because of concurrent transactions
+"""
+
+import asyncio
+import random
+
+from asyncpg import exceptions
+
+
+RETRYABLE_ERRORS = (exceptions.SerializationError,
+                    exceptions.DeadlockDetectedError)
+
+
+class RetryStats:
+    __slots__ = ('calls', 'retries', 'failures', 'errors')
+
+    def __init__(self):
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+        self.errors = {}
+
+    def stats(self):
+        return {
+            'calls': self.calls,
+            'retries': self.retries,
+            'failures': self.failures,
+            'errors': dict(self.errors),
+        }
+
+
+def backoff_delay(attempt, backoff, max_backoff):
+    """
+    exponential backoff with full jitter
+    """
+    return random.uniform(0, min(max_backoff, backoff * 2 ** attempt))
+
+
+async def retry(fn, retries=3, backoff=0.01, max_backoff=1.0, stats=None):
+    """
+    await `fn()` until it does not raise one of `RETRYABLE_ERRORS`,
+    at most `retries` more times.
+
+    :param fn: coroutine function taking no arguments, it should
+               acquire and release its own connection
+    :param int retries: retries after the first attempt
+    :param float backoff: base delay in seconds
+    :param float max_backoff: max delay in seconds
+    :param RetryStats stats: optional stats to record to
+    """
+    attempt = 0
+    if stats is not None:
+        stats.calls += 1
+    while True:
+        try:
+            return await fn()
+        except RETRYABLE_ERRORS as e:
+            if attempt >= retries:
+                if stats is not None:
+                    stats.failures += 1
+                raise
+            if stats is not None:
+                stats.retries += 1
+                name = type(e).__name__
+                stats.errors[name] = stats.errors.get(name, 0) + 1
+            await asyncio.sleep(backoff_delay(attempt, backoff, max_backoff))
+            attempt += 1
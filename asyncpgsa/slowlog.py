@@ -0,0 +1,148 @@
+"""
+logging of slow statements, with their query plans
+"""
+
+import asyncio
+import contextlib
+import json
+import random
+import re
+from collections import OrderedDict, deque
+from contextvars import Context, ContextVar
+
+from .log import slow_query_logger
+
+
+_threshold = ContextVar('asyncpgsa_slow_query_threshold', default=None)
+
+_EXPLAINABLE = re.compile(r'^\s*(SELECT|INSERT|UPDATE|DELETE|WITH|VALUES)\b',
+                          re.IGNORECASE)
+
+
+@contextlib.contextmanager
+def slow_query_threshold(seconds):
+    """
+    override the threshold of the pool's `SlowQueryLog` for the
+    statements run inside this block
+
+    with slow_query_threshold(0.05):
+        await pg.fetch(query)
+    """
+    token = _threshold.set(seconds)
+    try:
+        yield
+    finally:
+        _threshold.reset(token)
+
+
+class SlowQuery:
+    __slots__ = ('query', 'param_types', 'duration', 'plan')
+
+    def __init__(self, query, param_types, duration, plan=None):
+        self.query = query
+        self.param_types = param_types
+        self.duration = duration
+        self.plan = plan
+
+    def __repr__(self):
+        return '<SlowQuery {:.3f}s {!r}>'.format(self.duration, self.query)
+
+
+class SlowQueryLog:
+    """
+    Logs statements slower than `threshold` seconds to the
+    `asyncpgsa.slow_query` logger, with the types (not the values) of their
+    parameters. The most recent ones are kept in `recent`.
+
+    For a `sample_rate` fraction of them, `EXPLAIN (FORMAT JSON)` is run in
+    the background on another pool connection, and the plan is logged and
+    attached to the `SlowQuery`. Plans are kept per sql text, so each
+    statement shape is only explained once.
+    """
+
+    __slots__ = ('threshold', 'sample_rate', 'max_plans', 'explain_timeout',
+                 'pool', 'plans', 'recent', '_explaining', '_tasks')
+
+    def __init__(self, threshold=1.0, sample_rate=1.0, max_plans=1000,
+                 max_recent=100, explain_timeout=5.0):
+        """
+        :param float threshold: seconds after which a statement is slow
+        :param float sample_rate: fraction of new slow statements
+                                  to explain, 0 disables explaining
+        :param int max_plans: plans to keep
+        :param int max_recent: slow queries to keep in `recent`
+        :param float explain_timeout: timeout for acquire and explain
+        """
+        self.threshold = threshold
+        self.sample_rate = sample_rate
+        self.max_plans = max_plans
+        self.explain_timeout = explain_timeout
+        self.pool = None
+        self.plans = OrderedDict()
+        self.recent = deque(maxlen=max_recent)
+        self._explaining = set()
+        # running explains, referenced so they are not garbage collected
+        self._tasks = set()
+
+    def is_slow(self, duration):
+        threshold = _threshold.get()
+        if threshold is None:
+            threshold = self.threshold
+        return duration >= threshold
+
+    def record(self, query, args, duration):
+        """
+        called with every statement and its duration
+        """
+        if not self.is_slow(duration):
+            return None
+
+        slow = SlowQuery(query, [type(arg).__name__ for arg in args],
+                         duration, self.plans.get(query))
+        self.recent.append(slow)
+        slow_query_logger.warning(
+            'slow query (%.3fs): %s param types: %s',
+            duration, query, slow.param_types,
+            extra={'query': query, 'duration': duration, 'plan': slow.plan})
+
+        if (slow.plan is None and self.pool is not None
+                and query not in self._explaining
+                and _EXPLAINABLE.match(query)
+                and random.random() < self.sample_rate):
+            self._explaining.add(query)
+            # a fresh context, so the explain does not inherit the
+            # caller's deadline or threshold
+            task = Context().run(asyncio.ensure_future,
+                                 self._explain(slow, args))
+            self._tasks.add(task)
+            task.add_done_callback(self._explained)
+        return slow
+
+    def _explained(self, task):
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            slow_query_logger.error('explain failed',
+                                    exc_info=task.exception())
+
+    async def _explain(self, slow, args):
+        try:
+            async with self.pool.acquire(timeout=self.explain_timeout) as con:
+                plan = await con.fetchval(
+                    'EXPLAIN (FORMAT JSON) ' + slow.query, *args,
+                    timeout=self.explain_timeout)
+        except Exception:
+            slow_query_logger.debug('could not explain %s', slow.query,
+                                    exc_info=True)
+            return
+        finally:
+            self._explaining.discard(slow.query)
+
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        slow.plan = self.plans[slow.query] = plan
+        if len(self.plans) > self.max_plans:
+            self.plans.popitem(last=False)
+        slow_query_logger.warning(
+            'plan for slow query: %s\n%s', slow.query,
+            json.dumps(plan, indent=2),
+            extra={'query': slow.query, 'plan': plan})
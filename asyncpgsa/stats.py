@@ -0,0 +1,251 @@
+"""
+client side statement statistics, like pg_stat_statements
+"""
+
+from collections import OrderedDict, deque
+from weakref import WeakKeyDictionary
+
+
+class StatementStats:
+    """
+    timings of one sql text. Percentiles are computed over the most
+    recent `samples` calls.
+    """
+
+    __slots__ = ('query', 'calls', 'errors', 'rows', 'total_time',
+                 'max_time', 'compile_time', 'execute_time', '_samples',
+                 '_next')
+
+    def __init__(self, query, samples=128):
+        self.query = query
+        self.calls = 0
+        self.errors = 0
+        self.rows = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.compile_time = 0.0
+        self.execute_time = 0.0
+        self._samples = [0.0] * samples
+        self._next = 0
+
+    def record(self, compile_time, execute_time, rows, error=False):
+        elapsed = compile_time + execute_time
+        self._samples[self._next % len(self._samples)] = elapsed
+        self._next += 1
+        self.calls += 1
+        self.rows += rows
+        self.total_time += elapsed
+        self.compile_time += compile_time
+        self.execute_time += execute_time
+        if elapsed > self.max_time:
+            self.max_time = elapsed
+        if error:
+            self.errors += 1
+
+    def record_compile(self, compile_time):
+        """
+        compile time of a statement whose execution is not timed, e.g. one
+        streamed through a cursor. It is not counted as a call.
+        """
+        self.total_time += compile_time
+        self.compile_time += compile_time
+
+    @property
+    def mean_time(self):
+        return self.total_time / self.calls if self.calls else 0.0
+
+    def percentile(self, p):
+        samples = sorted(self._samples[:min(self._next, len(self._samples))])
+        if not samples:
+            return 0.0
+        return samples[min(int(p / 100 * len(samples)), len(samples) - 1)]
+
+    def snapshot(self):
+        return {
+            'query': self.query,
+            'calls': self.calls,
+            'errors': self.errors,
+            'rows': self.rows,
+            'total_time': self.total_time,
+            'mean_time': self.mean_time,
+            'max_time': self.max_time,
+            'p50_time': self.percentile(50),
+            'p95_time': self.percentile(95),
+            'p99_time': self.percentile(99),
+            'compile_time': self.compile_time,
+            'execute_time': self.execute_time,
+        }
+
+
+class StatementStatsTable:
+    """
+    `StatementStats` keyed by compiled sql, holding at most
+    `max_statements` entries (the least recently used is dropped)
+    """
+
+    __slots__ = ('max_statements', 'samples', '_entries')
+
+    def __init__(self, max_statements=1000, samples=128):
+        self.max_statements = max_statements
+        self.samples = samples
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __getitem__(self, query):
+        return self._entries[query]
+
+    def record(self, query, compile_time, execute_time, rows=0,
+               error=False):
+        """
+        :param query: compiled sql text
+        :param float compile_time: seconds spent in `compile_query`
+        :param float execute_time: seconds spent executing and fetching
+        :param int rows: rows returned
+        """
+        self._entry(query).record(compile_time, execute_time, rows, error)
+
+    def record_compile(self, query, compile_time):
+        """
+        see `StatementStats.record_compile`
+        """
+        self._entry(query).record_compile(compile_time)
+
+    def _entry(self, query):
+        entry = self._entries.get(query)
+        if entry is None:
+            entry = self._entries[query] = StatementStats(query, self.samples)
+            if len(self._entries) > self.max_statements:
+                self._entries.popitem(last=False)
+        else:
+            self._entries.move_to_end(query)
+        return entry
+
+    def snapshot(self):
+        """
+        :return: list of dicts, slowest total time first
+        """
+        return sorted((entry.snapshot() for entry in self._entries.values()),
+                      key=lambda s: s['total_time'], reverse=True)
+
+    def reset(self):
+        self._entries.clear()
+
+
+class StatementCacheStats:
+    """
+    Statement cache usage across a pool's connections. A connection's cache
+    thrashes when hot statements are evicted and prepared again, which
+    shows as many of its recent lookups missing and evicting. Misses that
+    fill the cache of a new connection do not count.
+    With `auto_resize` connections grow their cache to `suggested_size`
+    (at most `max_cache_size`) when they evict while thrashing.
+    """
+
+    __slots__ = ('pool', 'window', 'thrash_rate', 'auto_resize',
+                 'max_cache_size', 'max_tracked', 'lookups', 'misses',
+                 'named_prepares', 'evictions', 'resizes', '_distinct',
+                 '_windows')
+
+    def __init__(self, window=100, thrash_rate=0.05, auto_resize=False,
+                 max_cache_size=1000, max_tracked=10000):
+        """
+        :param int window: recent lookups per connection to judge by
+        :param float thrash_rate: share of the window that must have
+                                  missed and evicted to count as thrashing
+        :param bool auto_resize: grow the cache of thrashing connections
+        :param int max_cache_size: largest size to suggest or resize to
+        :param int max_tracked: distinct sql texts remembered at most
+        """
+        self.pool = None
+        self.window = window
+        self.thrash_rate = thrash_rate
+        self.auto_resize = auto_resize
+        self.max_cache_size = max_cache_size
+        self.max_tracked = max_tracked
+        self.lookups = 0
+        self.misses = 0
+        self.named_prepares = 0
+        self.evictions = 0
+        self.resizes = 0
+        self._distinct = set()
+        self._windows = WeakKeyDictionary()
+
+    def record(self, query, miss=False, evicted=False, named=False,
+               connection=None):
+        """
+        :param query: sql text looked up in the statement cache
+        :param bool miss: the statement had to be prepared
+        :param bool evicted: preparing it evicted another statement
+        :param bool named: prepared with `prepare`, bypassing the cache
+        :param connection: the connection whose cache was looked up
+        """
+        if named:
+            self.named_prepares += 1
+        else:
+            self.lookups += 1
+            self.misses += miss
+            self.evictions += evicted
+            if connection is not None:
+                window = self._windows.get(connection)
+                if window is None:
+                    window = self._windows[connection] = \
+                        deque(maxlen=self.window)
+                window.append(evicted)
+        if len(self._distinct) < self.max_tracked:
+            self._distinct.add(query)
+
+    @property
+    def distinct(self):
+        return len(self._distinct)
+
+    @property
+    def prepares(self):
+        return self.misses + self.named_prepares
+
+    def thrashing(self, connection=None):
+        """
+        :param connection: judge only this connection,
+                           by default any connection thrashing counts
+        """
+        if connection is not None:
+            windows = [self._windows.get(connection, ())]
+        else:
+            windows = list(self._windows.values())
+        limit = self.window * self.thrash_rate
+        return any(sum(window) >= limit for window in windows)
+
+    def suggested_size(self):
+        """
+        a statement_cache_size that fits every distinct statement seen
+        """
+        return min(self.max_cache_size, self.distinct + self.distinct // 4)
+
+    def snapshot(self):
+        return {
+            'lookups': self.lookups,
+            'misses': self.misses,
+            'named_prepares': self.named_prepares,
+            'prepares': self.prepares,
+            'evictions': self.evictions,
+            'distinct': self.distinct,
+            'resizes': self.resizes,
+            'thrashing': self.thrashing(),
+            'suggested_size': self.suggested_size(),
+        }
+
+    def reset(self):
+        self.lookups = self.misses = self.named_prepares = 0
+        self.evictions = self.resizes = 0
+        self._distinct.clear()
+        self._windows.clear()
+
+
+def count_rows(result):
+    """
+    rows in whatever Connection._execute returned
+    """
+    if isinstance(result, tuple):
+        result = result[0]
+    return len(result) if isinstance(result, list) else 0
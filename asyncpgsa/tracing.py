@@ -0,0 +1,150 @@
+"""
+hooks to trace where time goes: pool acquire, compiling, executing,
+cursors and transactions.
+
+spans emitted:
+    asyncpgsa.acquire      waiting for a pool connection
+    asyncpgsa.compile      compile_query
+    asyncpgsa.bind         running bind processors on the parameters,
+                           inside asyncpgsa.compile
+    asyncpgsa.process_rows preparing rows for a BufferedWriter flush
+    asyncpgsa.execute      a statement on a connection, including
+                           fetching and decoding the records
+    asyncpgsa.query        PG.query, prepare + fetch or cursor setup
+    asyncpgsa.transaction  a pool.transaction() block
+
+spans started inside `off_loop()`, like compiles offloaded to an executor,
+carry the attribute `asyncpgsa.off_loop`.
+"""
+
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+_hooks = []
+_off_loop = ContextVar('asyncpgsa_off_loop', default=False)
+
+
+class Hook:
+    """
+    Interface for tracing hooks. `start` is called when a span starts and
+    returns any state, which `end` gets back together with the final
+    attributes and the exception the span ended with (or None).
+    """
+
+    def start(self, name, attributes):
+        return None
+
+    def end(self, state, attributes, error):
+        pass
+
+
+def add_hook(hook):
+    _hooks.append(hook)
+
+
+def remove_hook(hook):
+    _hooks.remove(hook)
+
+
+class Span:
+    __slots__ = ('name', 'attributes', '_states')
+
+    def __init__(self, name, attributes):
+        self.name = name
+        self.attributes = attributes
+        self._states = None
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def __enter__(self):
+        self._states = [(hook, hook.start(self.name, self.attributes))
+                        for hook in list(_hooks)]
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        for hook, state in reversed(self._states):
+            hook.end(state, self.attributes, exc_val)
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def set(self, key, value):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+def span(name, attributes=None):
+    """
+    a context manager for a span, which does nothing if no hook is added
+
+    with span('asyncpgsa.compile') as s:
+        s.set('db.statement', sql)
+    """
+    if not _hooks:
+        return _NOOP
+    attributes = attributes or {}
+    if _off_loop.get():
+        attributes['asyncpgsa.off_loop'] = True
+    return Span(name, attributes)
+
+
+@contextmanager
+def off_loop():
+    """
+    marks the spans started inside as running outside the event loop
+    """
+    token = _off_loop.set(True)
+    try:
+        yield
+    finally:
+        _off_loop.reset(token)
+
+
+class OpenTelemetryHook(Hook):
+    """
+    maps spans to opentelemetry spans, nested spans become children
+
+    add_hook(OpenTelemetryHook())
+    """
+
+    def __init__(self, tracer=None):
+        # imported here, so only users of the hook pay for the import
+        try:
+            from opentelemetry import context, trace
+        except ImportError:
+            raise RuntimeError('opentelemetry-api is not installed')
+        self._context = context
+        self._trace = trace
+        self.tracer = tracer or trace.get_tracer('asyncpgsa')
+
+    def start(self, name, attributes):
+        otel_span = self.tracer.start_span(
+            name, kind=self._trace.SpanKind.CLIENT,
+            attributes=dict(attributes, **{'db.system': 'postgresql'}))
+        token = self._context.attach(
+            self._trace.set_span_in_context(otel_span))
+        return otel_span, token
+
+    def end(self, state, attributes, error):
+        otel_span, token = state
+        try:
+            self._context.detach(token)
+        except Exception:
+            # ended in another context than it started in
+            pass
+        otel_span.set_attributes(attributes)
+        if error is not None:
+            otel_span.record_exception(error)
+            otel_span.set_status(self._trace.Status(
+                self._trace.StatusCode.ERROR, str(error)))
+        otel_span.end()
@@ -1,5 +1,8 @@
 import asyncio
 
+from .deadline import remaining
+from .tracing import span
+
 
 class ConnectionTransactionContextManager:
     """
@@ -13,14 +16,30 @@ class ConnectionTransactionContextManager:
     """
 
     __slots__ = ('pool', 'acquire_context', 'transaction',
-                 'timeout', 'trans_kwargs')
+                 'timeout', 'trans_kwargs', 'cache', 'deferred', 'priority',
+                 'connection', 'span')
 
-    def __init__(self, pool, timeout=None, **kwargs):
+    def __init__(self, pool, timeout=None, cache=None, deferred=False,
+                 priority=None, **kwargs):
+        """
+        :param cache: an optional `QueryCache`, entries for tables written
+                      in the transaction are dropped once it commits
+        :param bool deferred: queue statements run with `conn.execute`
+                              (which then returns None) and send them in
+                              batches before the next read and at commit
+        :param priority: lane to acquire the connection in,
+                         see `AdmissionControl`
+        """
         self.pool = pool
         self.acquire_context = None
         self.transaction = None
         self.timeout = timeout
         self.trans_kwargs = kwargs
+        self.cache = cache
+        self.deferred = deferred
+        self.priority = priority
+        self.connection = None
+        self.span = None
 
     def __enter__(self):
         raise RuntimeError('Must use "async with" for a transaction')
@@ -29,21 +48,68 @@ class ConnectionTransactionContextManager:
         pass
 
     async def __aenter__(self):
-        self.acquire_context = self.pool.acquire(timeout=self.timeout)
-        con = await self.acquire_context.__aenter__()
+        self.span = span('asyncpgsa.transaction')
+        self.span.__enter__()
+        try:
+            self.acquire_context = self.pool.acquire(timeout=self.timeout,
+                                                     priority=self.priority)
+            con = await self.acquire_context.__aenter__()
+        except Exception as e:
+            self.span.__exit__(type(e), e, e.__traceback__)
+            raise
         self.transaction = con.transaction(**self.trans_kwargs)
         try:
             await self.transaction.__aenter__()
-        except Exception:
+        except Exception as e:
             await asyncio.shield(self.acquire_context.__aexit__())
+            self.span.__exit__(type(e), e, e.__traceback__)
             raise
+        left = remaining()
+        if left is not None:
+            # the server gives up too, even if the client goes away
+            try:
+                await con.execute('SET LOCAL statement_timeout = {:d}'.format(
+                    max(int(left * 1000), 1)))
+            except Exception as e:
+                self.connection = con
+                await self.__aexit__(type(e), e, e.__traceback__)
+                raise
+        if self.cache is not None:
+            con._track_writes()
+        if self.deferred:
+            con._defer_writes()
+        self.connection = con
         return con
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        async def _close():
+        async def _close(exc_type, exc_val, exc_tb):
+            flush_error = None
+            if self.deferred:
+                try:
+                    if exc_type is None:
+                        await self.connection.flush_deferred()
+                except Exception as e:
+                    # roll back instead of committing half the writes
+                    flush_error = exc_val = e
+                    exc_type, exc_tb = type(e), e.__traceback__
+                finally:
+                    self.connection._stop_deferring()
+
             try:
                 await self.transaction.__aexit__(exc_type, exc_val, exc_tb)
+                if self.cache is not None and exc_type is None:
+                    self.cache.invalidate(self.connection._written_tables)
             finally:
+                if self.cache is not None:
+                    self.connection._pop_written_tables()
                 await self.acquire_context.__aexit__(exc_type, exc_val, exc_tb)
 
-        await asyncio.shield(_close())
+            if flush_error is not None:
+                raise flush_error
+
+        try:
+            await asyncio.shield(_close(exc_type, exc_val, exc_tb))
+        except BaseException as e:
+            self.span.__exit__(type(e), e, e.__traceback__)
+            raise
+        self.span.__exit__(exc_type, exc_val, exc_tb)
@@ -0,0 +1,130 @@
+"""
+asyncpg codecs for the enum and composite types used by sqlalchemy metadata
+"""
+
+from sqlalchemy import types
+
+from .connection import default_dialect
+
+
+TYPES_QUERY = """
+SELECT q.name, n.nspname, t.typname
+FROM unnest($1::text[]) AS q(name)
+JOIN pg_type t ON t.oid = to_regtype(q.name)
+JOIN pg_namespace n ON n.oid = t.typnamespace
+"""
+
+
+class CompositeType(types.UserDefinedType):
+    """
+    a column of a postgres composite type, read and written as instances
+    of `python_class`, which must be iterable in field order and take the
+    fields as positional arguments (a namedtuple for example)
+
+    Column('address', CompositeType('address', Address))
+    """
+
+    def __init__(self, name, python_class, schema=None):
+        self.name = name
+        self.python_class = python_class
+        self.schema = schema
+
+    @property
+    def python_type(self):
+        return self.python_class
+
+    def get_col_spec(self, **kw):
+        return self.name
+
+    def bind_processor(self, dialect):
+        def process(value):
+            return None if value is None else tuple(value)
+        return process
+
+
+class TypeCodecs:
+    """
+    Finds the postgres enums with a python enum class, and the composite
+    types, of the columns in `metadata`, and registers asyncpg codecs for
+    them with `set_type_codec` so they are read as python objects.
+
+    Which of the types exist, and their schemas, is looked up with one
+    catalog query the first time and reused for every later connection.
+    `set_type_codec` still introspects each type, so a new connection
+    pays one round trip per registered type.
+    """
+
+    __slots__ = ('types', '_found')
+
+    def __init__(self, metadata, dialect=None):
+        preparer = (dialect or default_dialect()).identifier_preparer
+        self.types = {}
+        for table in metadata.tables.values():
+            for column in table.columns:
+                type_ = _unwrap(column.type)
+                if isinstance(type_, types.Enum) and type_.native_enum \
+                        and type_.enum_class is not None \
+                        or isinstance(type_, CompositeType):
+                    self.types.setdefault(preparer.format_type(type_), type_)
+        self._found = None
+
+    def clear(self):
+        """
+        forget the looked up types, e.g. after they were recreated
+        """
+        self._found = None
+
+    async def register(self, conn):
+        if not self.types:
+            return
+        if self._found is None:
+            self._found = await self._lookup(conn)
+
+        for name, (schema, typname) in self._found.items():
+            type_ = self.types[name]
+            if isinstance(type_, CompositeType):
+                await conn.set_type_codec(
+                    typname, schema=schema, format='tuple', encoder=tuple,
+                    decoder=_composite_decoder(type_.python_class))
+            else:
+                await conn.set_type_codec(
+                    typname, schema=schema, format='text',
+                    encoder=_enum_encoder(type_),
+                    decoder=_enum_decoder(type_))
+
+    async def _lookup(self, conn):
+        rows = await conn.fetch(TYPES_QUERY, list(self.types))
+        return {row['name']: (row['nspname'], row['typname'])
+                for row in rows}
+
+
+def _unwrap(type_):
+    while True:
+        if isinstance(type_, types.TypeDecorator):
+            type_ = type_.impl
+        elif isinstance(type_, types.ARRAY):
+            type_ = type_.item_type
+        else:
+            return type_
+
+
+def _enum_encoder(type_):
+    lookup = type_._valid_lookup
+
+    def encode(value):
+        return lookup.get(value, value)
+    return encode
+
+
+def _enum_decoder(type_):
+    lookup = type_._object_lookup
+
+    def decode(value):
+        return lookup.get(value, value)
+    return decode
+
+
+def _composite_decoder(python_type):
+    def decode(value):
+        return python_type(*value)
+    return decode
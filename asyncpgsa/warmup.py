@@ -0,0 +1,109 @@
+"""
+prepared statement warmup for new pool connections
+"""
+
+import json
+import os
+from collections import Counter
+
+from asyncpg.exceptions import PostgresError
+
+from .connection import compile_query
+from .log import query_logger
+
+
+class StatementRegistry:
+    """
+    Hot statements to prepare on every new connection, so the first
+    requests after a deploy or pool churn do not pay for parsing and
+    planning them.
+
+    Statements are either declared up front or learned by counting how
+    often each sql is prepared. With `path` set the learned counts are
+    loaded on creation and written back by `save` (and on pool close).
+    """
+
+    __slots__ = ('max_statements', 'min_count', 'max_tracked', 'path',
+                 'declared', 'counts')
+
+    def __init__(self, *, max_statements=50, min_count=10,
+                 max_tracked=10000, path=None):
+        """
+        :param int max_statements: statements prepared per connection,
+                                   keep it below statement_cache_size
+        :param int min_count: uses before a statement counts as hot
+        :param int max_tracked: distinct statements counted at most
+        :param str path: json file to persist learned statements to
+        """
+        self.max_statements = max_statements
+        self.min_count = min_count
+        self.max_tracked = max_tracked
+        self.path = path
+        self.declared = []
+        self.counts = Counter()
+        if path is not None and os.path.exists(path):
+            self.load()
+
+    def declare(self, query, dialect=None):
+        """
+        always prepare `query` (sql or a sqlalchemy statement)
+        """
+        sql, _ = compile_query(query, dialect=dialect)
+        if sql not in self.declared:
+            self.declared.append(sql)
+
+    def record(self, sql):
+        self.counts[sql] += 1
+        if len(self.counts) > self.max_tracked:
+            # drop the cold half instead of one entry per new statement
+            keep = self.counts.most_common(self.max_tracked // 2)
+            self.counts = Counter(dict(keep))
+
+    def forget(self, sql):
+        self.counts.pop(sql, None)
+        if sql in self.declared:
+            self.declared.remove(sql)
+
+    def hot(self):
+        """
+        :return: declared statements, then the most used learned ones
+        """
+        statements = list(self.declared[:self.max_statements])
+        for sql, count in self.counts.most_common():
+            if len(statements) >= self.max_statements \
+                    or count < self.min_count:
+                break
+            if sql not in statements:
+                statements.append(sql)
+        return statements
+
+    def load(self):
+        with open(self.path) as f:
+            counts = json.load(f)
+        self.counts.update(counts)
+
+    def save(self):
+        """
+        write the learned statements to `path`
+        """
+        if self.path is None:
+            return
+        hot = {sql: count for sql, count in self.counts.most_common(
+            self.max_statements) if count >= self.min_count}
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(hot, f)
+        os.replace(tmp, self.path)
+
+    async def warm(self, conn):
+        """
+        prepare the hot statements on `conn`, used as pool init hook
+        """
+        for sql in self.hot():
+            try:
+                await conn._prepare_cached(sql)
+            except PostgresError as e:
+                # e.g. the table went away since the statement was learned
+                query_logger.warning('dropping warmup statement %r: %s',
+                                     sql, e)
+                self.forget(sql)
@@ -13,28 +13,43 @@ def pytest_pycollect_makeitem(collector, name, obj):
 
 
 @pytest.fixture(scope='function')
-def pool(event_loop):
+def make_pool(event_loop):
+    """
+    factory for pools with extra create_pool kwargs,
+    pools are closed after the test
+    """
     from asyncpgsa import create_pool
     from . import HOST, PORT, USER, PASS, DB_NAME
 
-    pool = create_pool(
-        min_size=1,
-        max_size=3,
-        host=HOST,
-        port=PORT,
-        user=USER,
-        password=PASS,
-        database=DB_NAME,
-        timeout=1,
-        loop=event_loop
-    )
-
-    event_loop.run_until_complete(pool)
+    pools = []
+
+    async def make_pool(**kwargs):
+        options = dict(
+            min_size=1,
+            max_size=3,
+            host=HOST,
+            port=PORT,
+            user=USER,
+            password=PASS,
+            database=DB_NAME,
+            timeout=1,
+            loop=event_loop
+        )
+        options.update(kwargs)
+        pool = await create_pool(**options)
+        pools.append(pool)
+        return pool
 
     try:
-        yield pool
+        yield make_pool
     finally:
-        event_loop.run_until_complete(pool.close())
+        for pool in pools:
+            event_loop.run_until_complete(pool.close())
+
+
+@pytest.fixture(scope='function')
+def pool(make_pool, event_loop):
+    return event_loop.run_until_complete(make_pool())
 
 
 @pytest.fixture(scope='function')
@@ -0,0 +1,64 @@
+import asyncio
+
+import pytest
+
+from asyncpgsa.admission import AdmissionControl, Lane, PoolOverloadedError
+
+
+async def test_priority_lanes(make_pool):
+    admission = AdmissionControl([
+        Lane('interactive', reserved=1),
+        Lane('batch', max_queue=1),
+    ])
+    pool = await make_pool(min_size=1, max_size=2, admission=admission)
+
+    batch = await pool.acquire(priority='batch')
+    # the second connection is reserved for interactive callers
+    queued = asyncio.ensure_future(pool.acquire(priority='batch'))
+    await asyncio.sleep(0.01)
+    assert not queued.done()
+    with pytest.raises(PoolOverloadedError):
+        await pool.acquire()
+
+    async with pool.transaction(priority='interactive') as conn:
+        assert await conn.fetchval('SELECT 1') == 1
+
+    await pool.release(batch)
+    await pool.release(await asyncio.wait_for(queued, 1))
+
+    interactive, batch = admission.snapshot()
+    assert interactive['admitted'] == 1
+    assert batch['admitted'] == 2
+    assert batch['rejected'] == 1
+    assert batch['wait']['count'] == 2
+    assert interactive['in_use'] == batch['in_use'] == 0
+
+    with pytest.raises(ValueError):
+        await pool.acquire(priority='nope')
+
+
+async def test_admission_timeout(make_pool):
+    admission = AdmissionControl([Lane('default')])
+    pool = await make_pool(min_size=1, max_size=1, admission=admission)
+    async with pool.acquire():
+        with pytest.raises(asyncio.TimeoutError):
+            await pool.acquire(timeout=0.01)
+    assert admission.lanes['default'].timeouts == 1
+    assert not admission.lanes['default'].waiters
+
+
+async def test_admission_cancel_while_woken(make_pool):
+    admission = AdmissionControl([Lane('default')])
+    await make_pool(min_size=1, max_size=1, admission=admission)
+    lane = await admission.admit(None)
+
+    queued = asyncio.ensure_future(admission.admit(None))
+    await asyncio.sleep(0)
+    queued.cancel()
+    # wakes the waiter while it is being cancelled
+    admission.release(lane)
+    with pytest.raises(asyncio.CancelledError):
+        await queued
+    assert not lane.waiters
+    assert lane.in_use == 0
+    await asyncio.wait_for(admission.admit(None), 1)
@@ -0,0 +1,30 @@
+import asyncio
+
+from asyncpgsa.autoscale import PoolAutoscaler
+
+
+async def test_autoscaler_shrinks_idle_pool_and_grows_on_waiters(make_pool):
+    autoscaler = PoolAutoscaler(interval=3600, shrink_after=2,
+                                min_headroom=0)
+    pool = await make_pool(min_size=1, max_size=3, autoscale=autoscaler)
+    assert autoscaler.target_size == 3
+
+    # hysteresis: one quiet interval is not enough
+    assert await autoscaler.tick() == 3
+    assert await autoscaler.tick() == 2
+    assert autoscaler.headroom > 0
+    for _ in range(4):
+        await autoscaler.tick()
+    assert autoscaler.target_size == 1
+    assert pool.get_size() == 1
+
+    con = await pool.acquire()
+    waiter = asyncio.ensure_future(pool.acquire(timeout=1))
+    await asyncio.sleep(0.01)
+    assert not waiter.done()
+    assert await autoscaler.tick() == 2
+    await pool.release(await waiter)
+    await pool.release(con)
+
+    await pool.close()
+    assert autoscaler.parked == []
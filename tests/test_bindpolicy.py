@@ -0,0 +1,100 @@
+import datetime
+import enum
+import uuid
+from decimal import Decimal
+
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+from asyncpgsa import bindpolicy, connection
+
+
+class Color(enum.Enum):
+    red = 1
+
+
+class Mood(enum.Enum):
+    happy = 1
+
+
+things = sa.Table(
+    'things', sa.MetaData(),
+    sa.Column('id', postgresql.UUID(as_uuid=True)),
+    sa.Column('at', sa.DateTime(timezone=True)),
+    sa.Column('ratio', sa.Float),
+    sa.Column('amount', sa.Numeric),
+    sa.Column('tags', postgresql.ARRAY(sa.Integer)),
+    sa.Column('color', sa.Enum(Color, name='color')),
+    sa.Column('data', postgresql.JSONB),
+)
+
+CREATE = ('CREATE TEMP TABLE things (id uuid, at timestamptz, ratio float, '
+          'amount numeric, tags int[], color text, data jsonb) '
+          'ON COMMIT DROP')
+
+
+def values():
+    return {
+        'id': uuid.uuid4(),
+        'at': datetime.datetime.now(datetime.timezone.utc),
+        'ratio': Decimal('0.5'),
+        'amount': Decimal('1.25'),
+        'tags': [1, 2],
+        'color': Color.red,
+        'data': {'a': 1},
+    }
+
+
+def test_bind_policy():
+    row = values()
+    _, params = connection.compile_query(things.insert().values(row))
+    params = dict(zip(sorted(row), params))
+    # passed through to asyncpg's codecs
+    assert params['id'] is row['id']
+    assert params['at'] is row['at']
+    assert params['ratio'] is row['ratio']
+    assert params['tags'] is row['tags']
+    # still converted
+    assert params['amount'] == '1.25'
+    assert params['color'] == 'red'
+    assert params['data'] == '{"a": 1}'
+
+
+def test_bind_plan_is_cached():
+    query = sa.select([things.c.ratio]).where(things.c.id == uuid.uuid4())
+    compiled = query.compile(dialect=connection.default_dialect())
+    keys = sorted(compiled.params)
+    first = bindpolicy.bind_processors(
+        compiled, keys, connection.default_dialect(), compiled.string)
+    assert first is None
+    assert bindpolicy.bind_processors(
+        compiled, keys, connection.default_dialect(),
+        compiled.string) is first
+
+
+def test_bind_plan_per_type_instance():
+    value = sa.column('value')
+    for type_, param, expected in [
+            (sa.Enum(Mood, name='mood'), Mood.happy, 'happy'),
+            (sa.Enum(Color, name='color'), Color.red, 'red'),
+            (postgresql.ARRAY(sa.Integer), [1], [1]),
+            (postgresql.ARRAY(sa.Enum(Color, name='color')), [Color.red],
+             ['red'])]:
+        query = sa.select([value]).where(
+            value == sa.bindparam('param', param, type_=type_))
+        _, params = connection.compile_query(query)
+        assert params == [expected]
+
+
+async def test_dropped_processors_roundtrip(make_pool):
+    pool = await make_pool()
+    row = values()
+    async with pool.transaction() as conn:
+        await conn.execute(CREATE)
+        await conn.execute(things.insert().values(row))
+        stored = await conn.fetchrow(things.select())
+    assert stored['id'] == row['id']
+    assert stored['at'] == row['at']
+    assert stored['ratio'] == 0.5
+    assert stored['tags'] == [1, 2]
+    assert stored['color'] == 'red'
@@ -0,0 +1,62 @@
+import asyncio
+import logging
+
+import sqlalchemy as sa
+
+from asyncpgsa import connection
+from asyncpgsa.blocking import LoopBlockMonitor
+
+wide = sa.Table('wide', sa.MetaData(),
+                *[sa.Column('c{}'.format(i), sa.Integer) for i in range(50)])
+
+
+def test_monitor_reports_slow_compiles(caplog):
+    monitor = LoopBlockMonitor(threshold=0).install()
+    try:
+        with caplog.at_level(logging.WARNING, logger='asyncpgsa.blocking'):
+            for _ in range(2):
+                connection.compile_query(wide.insert().values(c0=1))
+            connection.compile_query('SELECT 1')
+    finally:
+        monitor.uninstall()
+
+    steps = [event.step for event in monitor.events]
+    assert steps == ['asyncpgsa.compile'] * 3
+    report = monitor.report()
+    assert report[0]['statement'].startswith('INSERT INTO wide')
+    assert {r['count'] for r in report if r['statement'] != 'SELECT 1'} == {2}
+    assert 'blocked the event loop' in caplog.records[0].getMessage()
+
+
+def test_monitor_threshold():
+    monitor = LoopBlockMonitor(threshold=10).install()
+    try:
+        connection.compile_query(wide.insert().values(c0=1))
+    finally:
+        monitor.uninstall()
+    assert not monitor.events
+    assert monitor.report() == []
+
+
+def test_monitor_keeps_most_recent_statements():
+    monitor = LoopBlockMonitor(threshold=0, max_statements=2).install()
+    try:
+        for i in range(3):
+            connection.compile_query('SELECT {}'.format(i))
+    finally:
+        monitor.uninstall()
+    assert sorted(r['statement'] for r in monitor.report()) == \
+        ['SELECT 1', 'SELECT 2']
+
+
+def test_monitor_ignores_offloaded_compiles():
+    offloader = connection.CompileOffloader(threshold=-1)
+    offloader._learn(connection.statement_shape(wide.select()), 1.0)
+    monitor = LoopBlockMonitor(threshold=0).install()
+    loop = asyncio.new_event_loop()
+    try:
+        loop.run_until_complete(offloader.compile(wide.select()))
+    finally:
+        loop.close()
+        monitor.uninstall()
+    assert not monitor.events
@@ -0,0 +1,103 @@
+import asyncio
+import enum
+
+import pytest
+import sqlalchemy as sa
+
+from asyncpgsa.bufferedwriter import BufferedWriter, BufferFullError
+
+
+class Kind(enum.Enum):
+    CLICK = 1
+    VIEW = 2
+
+
+events = sa.Table(
+    'asyncpgsa_events', sa.MetaData(),
+    sa.Column('id', sa.Integer),
+    sa.Column('kind', sa.Enum(Kind, native_enum=False)),
+    sa.Column('source', sa.String, default='web'),
+)
+
+
+@pytest.fixture
+def events_table(pool, event_loop):
+    event_loop.run_until_complete(pool.execute(
+        'CREATE TABLE asyncpgsa_events '
+        '(id int, kind varchar(10), source text)'))
+    try:
+        yield events
+    finally:
+        event_loop.run_until_complete(
+            pool.execute('DROP TABLE asyncpgsa_events'))
+
+
+async def _rows(pool):
+    return await pool.fetch('SELECT * FROM asyncpgsa_events ORDER BY id')
+
+
+@pytest.mark.parametrize('use_copy', [True, False])
+async def test_flush_on_max_rows(pool, events_table, use_copy):
+    writer = BufferedWriter(pool, events_table, max_rows=2, max_delay=60,
+                            use_copy=use_copy)
+    writer.write_nowait({'id': 1, 'kind': Kind.CLICK})
+    writer.write_nowait({'id': 2, 'kind': Kind.VIEW, 'source': 'app'})
+    assert writer._flushing is not None
+    await writer.flush()
+    rows = await _rows(pool)
+    assert [tuple(r) for r in rows] == [(1, 'CLICK', 'web'),
+                                         (2, 'VIEW', 'app')]
+    await writer.close()
+
+
+async def test_flush_on_max_delay(pool, events_table):
+    writer = BufferedWriter(pool, events_table, max_rows=100, max_delay=0.05)
+    writer.write_nowait({'id': 1})
+    assert await _rows(pool) == []
+    assert writer._timer is not None
+    while writer._flushing is None:
+        await asyncio.sleep(0.01)
+    await writer._flushing
+    assert len(await _rows(pool)) == 1
+    await writer.close()
+
+
+async def test_close_flushes(pool, events_table):
+    async with BufferedWriter(pool, events_table, max_delay=60) as writer:
+        for i in range(5):
+            await writer.write({'id': i})
+    assert len(await _rows(pool)) == 5
+    with pytest.raises(RuntimeError):
+        writer.write_nowait({'id': 6})
+
+
+async def test_backpressure(pool, events_table):
+    writer = BufferedWriter(pool, events_table, max_rows=10, max_delay=60,
+                            max_buffer=2)
+    writer.write_nowait({'id': 1})
+    writer.write_nowait({'id': 2})
+    with pytest.raises(BufferFullError):
+        writer.write_nowait({'id': 3})
+    await writer.write({'id': 3})
+    await writer.close()
+    assert len(await _rows(pool)) == 3
+
+
+async def test_failed_flush_keeps_rows(pool):
+    writer = BufferedWriter(pool, events, max_rows=2, max_delay=60)
+    writer.write_nowait({'id': 1})
+    writer.write_nowait({'id': 2})
+    with pytest.raises(Exception, match='does not exist'):
+        await writer.flush()
+    assert len(writer) == 2
+    with pytest.raises(Exception, match='does not exist'):
+        await writer.close()
+    assert len(writer) == 2
+
+    await pool.execute('CREATE TABLE asyncpgsa_events '
+                       '(id int, kind varchar(10), source text)')
+    try:
+        await writer.close()
+        assert len(await _rows(pool)) == 2
+    finally:
+        await pool.execute('DROP TABLE asyncpgsa_events')
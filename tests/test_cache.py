@@ -0,0 +1,83 @@
+import sqlalchemy as sa
+
+from asyncpgsa.cache import (QueryCache, make_key, referenced_tables,
+                             written_tables)
+
+metadata = sa.MetaData()
+flags = sa.Table('flags', metadata, sa.Column('name'), sa.Column('on'))
+tenants = sa.Table('tenants', metadata, sa.Column('id'), schema='acct')
+
+
+def test_referenced_tables():
+    query = sa.select([flags]).where(
+        flags.c.name.in_(sa.select([tenants.c.id])))
+    assert referenced_tables(query) == {'flags', 'acct.tenants'}
+    assert referenced_tables('SELECT * FROM flags') == frozenset()
+
+
+def test_written_tables():
+    assert written_tables(flags.update().values(on=True)) == {'flags'}
+    assert written_tables(tenants.delete()) == {'acct.tenants'}
+    assert written_tables(sa.select([flags])) == frozenset()
+
+
+def test_make_key_with_unhashable_params():
+    assert make_key('q', [[1, 2]]) == make_key('q', [[1, 2]])
+    assert make_key('q', [1]) != make_key('q', [2])
+
+
+def test_cache_hit_and_miss():
+    cache = QueryCache()
+    assert cache.get('a') is None
+    cache.set('a', [1, 2], ttl=60)
+    assert cache.get('a') == [1, 2]
+    assert cache.hits == 1
+    assert cache.misses == 1
+    assert cache.hit_rate == 0.5
+    assert cache.memory > 0
+
+
+def test_cache_ttl():
+    cache = QueryCache()
+    cache.set('a', [], ttl=-1)
+    assert cache.get('a') is None
+    assert len(cache) == 0
+
+
+def test_cache_lru_eviction():
+    cache = QueryCache(max_entries=2)
+    cache.set('a', [], ttl=60)
+    cache.set('b', [], ttl=60)
+    cache.get('a')
+    cache.set('c', [], ttl=60)
+    assert cache.get('b') is None
+    assert cache.get('a') == []
+    assert cache.evictions == 1
+
+
+def test_cache_invalidate_by_table():
+    cache = QueryCache()
+    cache.set('a', [], ttl=60, tables={'flags'})
+    cache.set('b', [], ttl=60, tables={'flags', 'acct.tenants'})
+    cache.set('c', [], ttl=60, tables={'acct.tenants'})
+    cache.invalidate({'flags'})
+    assert cache.get('a') is None
+    assert cache.get('b') is None
+    assert cache.get('c') == []
+    assert cache.stats()['invalidations'] == 2
+    assert cache.memory == cache._entries['c'].size
+
+
+def test_cache_skips_results_read_before_an_invalidation():
+    cache = QueryCache()
+    generation = cache.generation()
+    cache.invalidate({'flags'})
+    cache.set('a', [], ttl=60, tables={'flags'}, generation=generation)
+    assert cache.get('a') is None
+    cache.set('b', [], ttl=60, tables={'other'}, generation=generation)
+    assert cache.get('b') == []
+
+    generation = cache.generation()
+    cache.clear()
+    cache.set('c', [], ttl=60, tables={'other'}, generation=generation)
+    assert cache.get('c') is None
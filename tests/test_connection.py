@@ -2,6 +2,7 @@ import enum
 import json
 import logging
 import uuid
+from concurrent.futures import Future
 from functools import partial
 
 import sqlalchemy as sa
@@ -149,3 +150,60 @@ def test_compile_drop_table_ddl():
     drop_query, params = connection.compile_query(drop_statement)
     assert drop_query == '\nDROP TABLE ddl_test_table'
     assert len(params) == 0
+
+
+async def test_compile_offloader_learns_heavy_shapes():
+    calls = []
+
+    class Executor:
+        def submit(self, fn, *args):
+            calls.append(fn)
+            future = Future()
+            future.set_result(fn(*args))
+            return future
+
+    offloader = connection.CompileOffloader(threshold=0.0,
+                                            executor=Executor())
+    query = file_table.select().where(file_table.c.id == 1)
+    expected = connection.compile_query(query)
+
+    assert await offloader.compile(query) == expected
+    assert not calls
+    assert await offloader.compile(query) == expected
+    assert len(calls) == 1
+
+    assert await offloader.compile('SELECT 1') == ('SELECT 1', ())
+    assert len(offloader.costs) == 1
+
+
+def test_statement_shape():
+    shape = connection.statement_shape
+    assert shape('SELECT 1') is None
+    assert shape(sa.text('SELECT 1')) == 'SELECT 1'
+    assert shape(file_table.select().where(file_table.c.id == 1)) == \
+        shape(file_table.select().where(file_table.c.id == 2))
+    assert shape(file_table.insert().values([{'id': 1}])) != \
+        shape(file_table.insert().values([{'id': 1}, {'id': 2}]))
+
+
+def test_statement_shape_is_stable_for_derived_froms():
+    shape = connection.statement_shape
+
+    def build():
+        other = file_table.alias('other')
+        recent = sa.select([file_table.c.id]).limit(10).cte('recent')
+        joined = file_table.join(other, file_table.c.id == other.c.id) \
+            .join(recent, recent.c.id == file_table.c.id)
+        subquery = sa.select([file_table.c.id]).alias()
+        return [
+            sa.select([file_table.c.id]).select_from(joined),
+            sa.select([subquery.c.id]),
+            sa.select(['*']).select_from(sa.text('generate_series(1, 3)')),
+            sa.union(file_table.select(), file_table.select()),
+        ]
+
+    first, second = build(), build()
+    assert [shape(q) for q in first] == [shape(q) for q in second]
+    assert len({shape(q) for q in first}) == len(first)
+    assert shape(file_table.alias('a').select()) != \
+        shape(file_table.alias('b').select())
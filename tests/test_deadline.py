@@ -0,0 +1,70 @@
+import asyncio
+import time
+
+import pytest
+
+from asyncpgsa.deadline import (DeadlineExceeded, deadline,
+                                effective_timeout, remaining)
+
+
+def test_nested_deadlines_only_shorten():
+    assert remaining() is None
+    assert effective_timeout(5) == 5
+    with deadline(1):
+        with deadline(10):
+            assert 0.9 < remaining() <= 1
+            assert effective_timeout(0.5) == 0.5
+        with deadline(0.1):
+            assert effective_timeout(None) <= 0.1
+    with deadline(-1):
+        with pytest.raises(DeadlineExceeded):
+            effective_timeout(None)
+
+
+async def test_deadline_covers_acquire(make_pool):
+    pool = await make_pool(min_size=1, max_size=1)
+    async with pool.acquire():
+        start = time.monotonic()
+        with deadline(0.05), pytest.raises(asyncio.TimeoutError):
+            async with pool.transaction():
+                pass
+        assert time.monotonic() - start < 0.5
+
+
+async def test_deadline_cancels_statements(make_pool):
+    pool = await make_pool(min_size=1, max_size=1)
+    with deadline(0.2):
+        async with pool.transaction() as conn:
+            timeout = await conn.fetchval('SHOW statement_timeout')
+            assert 1 <= int(timeout.rstrip('ms')) <= 200
+
+    start = time.monotonic()
+    with deadline(0.1), pytest.raises(asyncio.TimeoutError):
+        async with pool.acquire() as conn:
+            await conn.execute('SELECT pg_sleep(5)')
+    assert time.monotonic() - start < 1
+
+    async with pool.acquire() as conn:
+        assert await conn.fetchval('SHOW statement_timeout') == '0'
+        with deadline(0):
+            with pytest.raises(DeadlineExceeded):
+                await conn.fetchval('SELECT 1')
+
+
+async def test_expired_deadline_keeps_connection(make_pool):
+    pool = await make_pool(min_size=1, max_size=1)
+    async with pool.acquire() as con:
+        pid = con.get_server_pid()
+
+    with deadline(0.05):
+        async with pool.transaction() as con:
+            await con.execute('SELECT 1')
+            await asyncio.sleep(0.1)
+    with deadline(0.05):
+        async with pool.acquire() as con:
+            async with con.transaction():
+                await asyncio.sleep(0.1)
+
+    # neither COMMIT nor the reset on release ran into the deadline
+    async with pool.acquire() as con:
+        assert con.get_server_pid() == pid
@@ -0,0 +1,29 @@
+import subprocess
+import sys
+
+# generous, a cold `import sqlalchemy` alone takes several times this
+IMPORT_BUDGET = 0.05
+
+SCRIPT = '''
+import sys, time
+start = time.perf_counter()
+import asyncpgsa
+elapsed = time.perf_counter() - start
+print(elapsed, 'sqlalchemy' in sys.modules, 'asyncpg' in sys.modules)
+'''
+
+
+def test_import_is_lazy():
+    out = subprocess.check_output([sys.executable, '-c', SCRIPT])
+    elapsed, sqlalchemy, asyncpg = out.decode().split()
+    assert sqlalchemy == asyncpg == 'False'
+    assert float(elapsed) < IMPORT_BUDGET
+
+
+def test_lazy_attributes():
+    import asyncpgsa
+    from asyncpgsa.pgsingleton import PG
+
+    assert isinstance(asyncpgsa.pg, PG)
+    assert asyncpgsa.pg is asyncpgsa.pg
+    assert set(asyncpgsa.__all__) <= set(dir(asyncpgsa))
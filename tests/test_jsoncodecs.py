@@ -0,0 +1,55 @@
+import json
+import uuid
+from functools import partial
+
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+from asyncpgsa import connection
+
+documents = sa.Table(
+    'documents', sa.MetaData(),
+    sa.Column('data', postgresql.JSON),
+    sa.Column('bdata', postgresql.JSONB),
+)
+
+CREATE = ('CREATE TEMP TABLE documents (data json, bdata jsonb) '
+          'ON COMMIT DROP')
+
+
+async def test_json_codecs(make_pool):
+    pool = await make_pool(json_codecs=True)
+    doc = {'a': [1, 'x', None], 'b': {'c': 1.5}}
+
+    query = documents.insert().values(data=doc, bdata=doc)
+    _, params = connection.compile_query(query, dialect=pool.dialect)
+    # left to asyncpg, not serialized by sqlalchemy
+    assert params == [doc, doc]
+
+    async with pool.transaction() as conn:
+        await conn.execute(CREATE)
+        await conn.execute(query)
+        row = await conn.fetchrow(documents.select())
+        assert row['data'] == row['bdata'] == doc
+        assert await conn.fetchval(
+            "SELECT bdata->'b'->>'c' FROM documents") == '1.5'
+
+
+async def test_json_codecs_use_dialect_serializer(make_pool):
+    class JSONEncoder(json.JSONEncoder):
+        def default(self, o):
+            if isinstance(o, uuid.UUID):
+                return str(o)
+            return super().default(o)
+
+    dialect = connection.get_dialect(
+        json_serializer=partial(json.dumps, cls=JSONEncoder))
+    pool = await make_pool(dialect=dialect, json_codecs=True)
+    assert pool.dialect is not dialect
+
+    key = uuid.uuid4()
+    async with pool.transaction() as conn:
+        await conn.execute(CREATE)
+        await conn.execute(documents.insert().values(bdata={'key': key}))
+        assert await conn.fetchval(documents.select().with_only_columns(
+            [documents.c.bdata])) == {'key': str(key)}
@@ -0,0 +1,120 @@
+import asyncio
+
+import pytest
+import sqlalchemy as sa
+
+from asyncpgsa.listener import (Listener, Notification, table_change_trigger,
+                                tables_from_notifications)
+
+
+async def _wait_for(predicate, timeout=2):
+    for _ in range(int(timeout / 0.01)):
+        if predicate():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError('timed out')
+
+
+async def test_listener_batches_notifications(pool):
+    received = []
+
+    async def handler(notifications):
+        received.append(notifications)
+
+    listener = Listener(pool.new_connection, batch_delay=0.05)
+    try:
+        await listener.add('asyncpgsa_test', handler)
+        async with pool.acquire() as con:
+            for i in range(3):
+                await con.execute("NOTIFY asyncpgsa_test, '{}'".format(i))
+        await _wait_for(lambda: sum(map(len, received)) == 3)
+    finally:
+        await listener.close()
+
+    assert len(received) < 3
+    assert [n.payload for batch in received for n in batch] == ['0', '1', '2']
+
+
+async def test_listener_reconnects(pool):
+    received = []
+    reconnects = []
+
+    async def handler(notifications):
+        received.extend(notifications)
+
+    listener = Listener(pool.new_connection, reconnect_delay=0.01,
+                        on_reconnect=lambda: reconnects.append(1))
+    try:
+        await listener.add('asyncpgsa_test', handler)
+        pid = listener._con.get_server_pid()
+        async with pool.acquire() as con:
+            await con.execute('SELECT pg_terminate_backend($1)', pid)
+            await _wait_for(lambda: reconnects and listener.connected)
+            await con.execute("NOTIFY asyncpgsa_test, 'after'")
+        await _wait_for(lambda: received)
+    finally:
+        await listener.close()
+
+    assert received[0].payload == 'after'
+
+
+async def test_table_change_trigger(pool):
+    table = sa.Table('asyncpgsa_listener_test', sa.MetaData(),
+                     sa.Column('id', sa.Integer))
+    received = []
+
+    async def handler(notifications):
+        received.extend(notifications)
+
+    listener = Listener(pool.new_connection)
+    async with pool.acquire() as con:
+        await con.execute('CREATE TABLE asyncpgsa_listener_test (id int)')
+        try:
+            for ddl in table_change_trigger(table, channel='asyncpgsa_tc'):
+                await con.execute(ddl)
+            await listener.add('asyncpgsa_tc', handler)
+            await con.execute(table.insert().values(id=1))
+            await _wait_for(lambda: received)
+        finally:
+            await listener.close()
+            await con.execute('DROP TABLE asyncpgsa_listener_test')
+            await con.execute(
+                'DROP FUNCTION IF EXISTS asyncpgsa_notify_table_change()')
+
+    assert tables_from_notifications(received) == {'asyncpgsa_listener_test'}
+
+
+async def test_listener_closes_connection_when_listen_fails(pool):
+    connections = []
+
+    async def connect():
+        con = await pool.new_connection()
+        connections.append(con)
+
+        async def fail(*args):
+            raise OSError('gone')
+        con.add_listener = fail
+        return con
+
+    async def handler(notifications):
+        pass
+
+    listener = Listener(connect)
+    with pytest.raises(OSError):
+        await listener.add('asyncpgsa_test', handler)
+    assert connections[0].is_closed()
+
+
+async def test_pool_new_connection_is_outside_the_pool(pool):
+    con = await pool.new_connection()
+    try:
+        assert type(con) is pool._connection_class
+        assert await con.fetchval('SELECT 1') == 1
+    finally:
+        await con.close()
+
+
+def test_tables_from_notifications_ignores_garbage():
+    notifications = [Notification(1, 'c', '{"table": "a", "op": "INSERT"}'),
+                     Notification(1, 'c', 'not json')]
+    assert tables_from_notifications(notifications) == {'a'}
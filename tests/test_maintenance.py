@@ -0,0 +1,38 @@
+from asyncpgsa.maintenance import PoolMaintainer
+
+
+async def test_maintainer_replaces_broken_connections(make_pool):
+    maintainer = PoolMaintainer(interval=3600)
+    pool = await make_pool(min_size=1, max_size=1, maintenance=maintainer)
+    assert maintainer.max_age is None
+
+    async with pool.acquire() as con:
+        pid = con.get_server_pid()
+        broken = con._con
+
+    async def half_open(*args, **kwargs):
+        raise ConnectionResetError('gone')
+    broken.fetchval = half_open
+
+    await maintainer.maintain()
+    assert maintainer.failures == 1
+    assert broken.is_closed()
+    # reopened off the request path
+    assert pool.get_idle_size() == 1
+    async with pool.acquire() as con:
+        assert con.get_server_pid() != pid
+        assert await con.fetchval('SELECT 1') == 1
+
+
+async def test_maintainer_recycles_old_connections(make_pool):
+    maintainer = PoolMaintainer(interval=3600, max_age=0)
+    pool = await make_pool(min_size=1, max_size=1, maintenance=maintainer)
+    async with pool.acquire() as con:
+        pid = con.get_server_pid()
+
+    await maintainer.maintain()
+    await maintainer.maintain()
+    assert maintainer.recycled == 1
+    assert pool.get_idle_size() == 1
+    async with pool.acquire() as con:
+        assert con.get_server_pid() != pid
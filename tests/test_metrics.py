@@ -0,0 +1,75 @@
+import pytest
+
+from asyncpgsa.metrics import (Histogram, MetricsExporter,
+                               PrometheusExporter, render_prometheus)
+
+
+def test_histogram():
+    hist = Histogram(buckets=(0.1, 1.0))
+    for value in (0.05, 0.1, 0.5, 2.0):
+        hist.observe(value)
+    assert hist.counts == [2, 1, 1]
+    assert hist.count == 4
+    assert hist.sum == 2.65
+    assert hist.max == 2.0
+    assert hist.quantile(0.5) == 0.1
+    assert hist.quantile(0.75) == 1.0
+    assert hist.quantile(1.0) == 2.0
+
+    snapshot = hist.snapshot()
+    hist.observe(0.5)
+    recent = hist.since(snapshot)
+    assert recent.counts == [0, 1, 0]
+    assert recent.quantile(0.5) == 1.0
+    # the max of the window, not the all time max
+    assert recent.max == 1.0
+    assert hist.since(hist.snapshot()).max == 0.0
+
+    snapshot = hist.snapshot()
+    hist.observe(3.0)
+    assert hist.since(snapshot).max == 3.0
+
+
+async def test_pool_metrics(pool):
+    async with pool.acquire() as con:
+        assert pool.metrics.in_use == 1
+        await con.fetchval('SELECT 1')
+    snapshot = pool.metrics.snapshot()
+    assert snapshot['in_use'] == 0
+    assert snapshot['idle'] == snapshot['size'] >= 1
+    assert snapshot['acquires'] == 1
+    assert snapshot['acquire_wait']['count'] == 1
+    assert snapshot['hold_time']['count'] == 1
+    assert snapshot['waiters'] == 0
+
+
+async def test_pool_metrics_exporters(pool):
+    class Exporter(MetricsExporter):
+        def export(self, snapshot):
+            return snapshot['max_size']
+
+    prometheus = PrometheusExporter(labels={'pool': 'main'})
+    pool.metrics.add_exporter(Exporter())
+    pool.metrics.add_exporter(prometheus)
+    assert pool.metrics.export()[0] == 3
+    assert 'asyncpgsa_pool_max_size{pool="main"} 3\n' in prometheus.text
+
+    with pytest.raises(TypeError):
+        MetricsExporter()
+
+
+def test_render_prometheus():
+    hist = Histogram(buckets=(0.5,))
+    hist.observe(0.1)
+    hist.observe(1)
+    snapshot = {'size': 2, 'max_size': 3, 'in_use': 1, 'idle': 1,
+                'waiters': 0, 'acquires': 5, 'timeouts': 1,
+                'acquire_wait': hist.snapshot(),
+                'hold_time': Histogram(buckets=(0.5,)).snapshot()}
+    text = render_prometheus(snapshot, prefix='db')
+    assert '# TYPE db_in_use gauge\ndb_in_use 1\n' in text
+    assert '# TYPE db_timeouts_total counter\ndb_timeouts_total 1\n' in text
+    assert ('db_acquire_wait_seconds_bucket{le="0.5"} 1\n'
+            'db_acquire_wait_seconds_bucket{le="+Inf"} 2\n'
+            'db_acquire_wait_seconds_sum 1.1\n'
+            'db_acquire_wait_seconds_count 2\n') in text
@@ -1,8 +1,13 @@
-from asyncpgsa import pg
+import asyncio
+from time import perf_counter
+
+import asyncpg
+from asyncpg.exceptions import DivisionByZeroError, SerializationError
+from asyncpgsa import pg, compile_query
 import pytest
 import sqlalchemy as sa
 
-from . import HOST, PORT, USER, PASS, DB_NAME
+from . import HOST, PORT, USER, PASS, DB_NAME, URL
 
 
 @pytest.fixture(scope='function', autouse=True)
@@ -150,3 +155,143 @@ async def test_begin():
     async with pg.begin() as conn:
         for row in await conn.fetch(query):
             assert row['a'] == 4.0
+
+
+async def test_fetch_cache():
+    pg.cache.clear()
+    first = await pg.fetch(query, cache=60)
+    first.clear()
+    second = await pg.fetch(query, cache=60)
+    assert second[0]['a'] == 4.0
+    second.append(None)
+    assert len(await pg.fetch(query, cache=60)) == 1
+    assert pg.cache.stats()['hits'] >= 2
+
+
+async def test_transaction_invalidates_cache():
+    table = sa.Table('pg_cache_test', sa.MetaData(),
+                     sa.Column('id', sa.Integer))
+    pg.cache.set('key', [], ttl=60, tables={'pg_cache_test'})
+    async with pg.transaction() as conn:
+        await conn.execute('CREATE TEMP TABLE pg_cache_test (id int) '
+                           'ON COMMIT DROP')
+        await conn.execute(table.insert().values(id=1))
+        assert pg.cache.get('key') == []
+    assert pg.cache.get('key') is None
+
+
+async def test_run_in_transaction_retries():
+    pids = []
+
+    async def work(conn, value):
+        pids.append(await conn.fetchval('SELECT txid_current()'))
+        if len(pids) == 1:
+            raise SerializationError('could not serialize access')
+        return value
+
+    retries = pg.retry_stats.retries
+    assert await pg.run_in_transaction(work, 42, backoff=0) == 42
+    assert pids[0] != pids[1]
+    assert pg.retry_stats.retries == retries + 1
+
+
+async def test_pg_query_cursor_is_deferrable():
+    settings = sa.select([sa.func.current_setting('transaction_isolation'),
+                          sa.func.current_setting('transaction_read_only'),
+                          sa.func.current_setting('transaction_deferrable')])
+    async with pg.query(settings) as cursor:
+        rows = [tuple(row) async for row in cursor]
+    assert rows == [('serializable', 'on', 'on')]
+
+
+async def test_stats():
+    await pg.init(host=HOST, port=PORT, database=DB_NAME, user=USER,
+                  password=PASS, min_size=1, max_size=2,
+                  statement_stats=True)
+    await pg.fetch(query)
+    await pg.query(query)
+    stats = {s['query']: s for s in pg.stats()}
+    assert stats[compile_query(query)[0]]['calls'] == 2
+    pg.reset_stats()
+    assert pg.stats() == []
+
+
+async def test_pgbouncer_mode():
+    await pg.init(host=HOST, port=PORT, database=DB_NAME, user=USER,
+                  password=PASS, min_size=1, max_size=1,
+                  pgbouncer_mode=True)
+    numbers = sa.select([sa.column('n')]).select_from(
+        sa.text('generate_series(1, :top) AS n')).params(top=7)
+
+    assert [r['n'] for r in await pg.query(numbers)] == list(range(1, 8))
+    async with pg.query(numbers, prefetch=3) as cursor:
+        assert [r['n'] async for r in cursor] == list(range(1, 8))
+
+    async with pg.transaction() as conn:
+        cursor = await conn.cursor(numbers)
+        assert await cursor.forward(2) == 2
+        assert (await cursor.fetchrow())['n'] == 3
+        assert [r['n'] for r in await cursor.fetch(10)] == [4, 5, 6, 7]
+        assert await conn.fetchval(
+            'SELECT count(*) FROM pg_prepared_statements') == 0
+
+
+async def test_listen_on_dsn():
+    received = asyncio.Event()
+
+    async def handler(notifications):
+        received.set()
+
+    try:
+        await pg.listen('asyncpgsa_test', handler, dsn=URL,
+                        batch_delay=0.01)
+        # a plain asyncpg connection, not one made like the pool's
+        assert type(pg.listener._con) is asyncpg.Connection
+        await pg.execute("NOTIFY asyncpgsa_test, 'x'")
+        await asyncio.wait_for(received.wait(), 5)
+    finally:
+        await pg.listener.close()
+        pg.listener = None
+
+
+async def test_gather():
+    sleep = 'SELECT pg_sleep(0.2), $1::int AS n'
+    start = perf_counter()
+    five = sa.select([sa.cast(sa.literal(5), sa.Integer).label('n')])
+    results = await pg.gather(*((sleep, n) for n in range(3)), five)
+    assert perf_counter() - start < 0.5
+    assert [rows[0]['n'] for rows in results] == [0, 1, 2, 5]
+
+    results = await pg.gather(*((sleep, n) for n in range(3)),
+                              concurrency=1)
+    assert [rows[0]['n'] for rows in results] == [0, 1, 2]
+
+
+async def test_gather_snapshot():
+    query = ('SELECT txid_current_snapshot()::text AS snapshot, '
+             "current_setting('transaction_read_only') AS read_only, "
+             'pg_sleep(0.1)')
+    start = perf_counter()
+    results = await pg.gather(*[query] * 4, snapshot=True)
+    assert perf_counter() - start < 0.35
+    assert len({rows[0]['snapshot'] for rows in results}) == 1
+    assert {rows[0]['read_only'] for rows in results} == {'on'}
+
+
+async def test_concurrent_gather_snapshots_share_a_small_pool():
+    await pg.init(host=HOST, port=PORT, database=DB_NAME, user=USER,
+                  password=PASS, min_size=1, max_size=2)
+    queries = ['SELECT pg_sleep(0.05)'] * 3
+    results = await asyncio.wait_for(asyncio.gather(
+        pg.gather(*queries, snapshot=True),
+        pg.gather(*queries, snapshot=True)), 5)
+    assert [len(r) for r in results] == [3, 3]
+    assert pg.pool._queue.qsize() == pg.pool.get_max_size()
+
+
+async def test_gather_error_releases_connections():
+    with pytest.raises(DivisionByZeroError):
+        await pg.gather('SELECT pg_sleep(0.1)', 'SELECT 1 / 0',
+                        snapshot=True)
+    assert await pg.fetchval('SELECT 1') == 1
+    assert pg.pool._queue.qsize() == pg.pool.get_max_size()
@@ -1,5 +1,16 @@
+import inspect
+
+import asyncpg
+import pytest
 import sqlalchemy as sa
 
+from asyncpgsa import create_pool
+
+
+def test_create_pool_documents_its_own_arguments():
+    assert 'statement_stats' in inspect.signature(create_pool).parameters
+    assert ':param statement_stats:' in create_pool.__doc__
+
 
 async def test_pool_basic(pool):
     async with pool.acquire() as con:
@@ -71,3 +82,95 @@ async def test_falsyness_of_rows_on_fetch(pool):
         rows = await conn.fetch('SELECT * FROM pg_stat_activity '
                                   'WHERE pid=400')
         assert bool(rows) == False
+
+
+async def test_deferred_transaction(pool):
+    table = sa.Table('deferred_test', sa.MetaData(),
+                     sa.Column('id', sa.Integer))
+    async with pool.transaction(deferred=True) as conn:
+        assert await conn.execute('CREATE TEMP TABLE deferred_test (id int) '
+                                  'ON COMMIT DROP') is None
+        for i in range(3):
+            assert await conn.execute(table.insert().values(id=i)) is None
+        assert len(conn._deferred) == 4
+
+        rows = await conn.fetch(table.select().order_by(table.c.id))
+        assert [r['id'] for r in rows] == [0, 1, 2]
+        assert conn._deferred == []
+
+        await conn.execute(table.delete())
+        await conn.execute(table.insert().values(id=9))
+
+    async with pool.acquire() as conn:
+        assert conn._deferred is None
+
+
+async def test_execute_pipeline(pool):
+    table = sa.Table('pipeline_test', sa.MetaData(),
+                     sa.Column('id', sa.Integer),
+                     sa.Column('name', sa.String))
+    async with pool.transaction() as conn:
+        results = await conn.execute_pipeline([
+            'CREATE TEMP TABLE pipeline_test (id int, name text) '
+            'ON COMMIT DROP',
+            'CREATE INDEX ON pipeline_test (id)',
+            table.insert().values(id=1, name='a'),
+            table.insert().values(id=2, name='b'),
+            ('INSERT INTO pipeline_test VALUES ($1, $2)', 3, 'c'),
+            table.insert().values(id=4, name='d').returning(table.c.id),
+            'DELETE FROM pipeline_test WHERE id = 1',
+        ])
+        assert results[:2] == [None, 'CREATE INDEX']
+        assert results[2:5] == [None, None, None]
+        assert [r['id'] for r in results[5]] == [4]
+        assert results[6] == 'DELETE 1'
+
+        rows = await conn.fetch(table.select().order_by(table.c.id))
+        assert [r['name'] for r in rows] == ['b', 'c', 'd']
+
+
+async def test_execute_pipeline_script_is_one_implicit_transaction(pool):
+    async with pool.acquire() as conn:
+        assert await conn.execute_pipeline(['SELECT 1', 'SELECT 2']) == \
+            [None, 'SELECT 1']
+        with pytest.raises(asyncpg.DivisionByZeroError):
+            await conn.execute_pipeline([
+                'CREATE TABLE pipeline_rollback_test (id int)',
+                'SELECT 1 / 0',
+            ])
+        assert await conn.fetchval(
+            "SELECT to_regclass('pipeline_rollback_test')") is None
+
+
+async def test_execute_pipeline_statement_with_trailing_comment(pool):
+    async with pool.acquire() as conn:
+        assert await conn.execute_pipeline([
+            'SELECT 1 -- one',
+            'CREATE TEMP TABLE pipeline_comment_test (id int)',
+        ]) == [None, 'CREATE TABLE']
+        assert await conn.fetchval(
+            "SELECT to_regclass('pipeline_comment_test')") is not None
+
+
+async def test_deferred_transaction_flushes_on_commit(pool):
+    table = sa.Table('deferred_commit_test', sa.MetaData(),
+                     sa.Column('id', sa.Integer))
+    await pool.execute('CREATE TABLE deferred_commit_test (id int)')
+    try:
+        async with pool.transaction(deferred=True) as conn:
+            await conn.execute(table.insert().values(id=1))
+        assert await pool.fetchval('SELECT count(*) '
+                                   'FROM deferred_commit_test') == 1
+
+        try:
+            async with pool.transaction(deferred=True) as conn:
+                await conn.execute(table.insert().values(id=2))
+                await conn.execute('SELECT 1/0')
+        except Exception as e:
+            assert 'division by zero' in str(e)
+        else:
+            raise Exception('Should have raised')
+        assert await pool.fetchval('SELECT count(*) '
+                                   'FROM deferred_commit_test') == 1
+    finally:
+        await pool.execute('DROP TABLE deferred_commit_test')
@@ -40,9 +40,8 @@ SAMPLE_DATA = [
     {
         't_string': 'test3',
         't_list': ['foo', 'bar'],
-        # FIXME: elements of Enum subclasses returned as strings
-        # 't_enum': MyEnum.ITEM_1,
-        # 't_int_enum': MyIntEnum.ITEM_1,
+        't_enum': MyEnum.ITEM_1,
+        't_int_enum': MyIntEnum.ITEM_1,
         't_datetime': datetime(2017, 1, 1),
         # FIXME: passing in a date object doesn't work...
         # 't_date': date(2017, 1, 1),
@@ -52,9 +51,8 @@ SAMPLE_DATA = [
     {
         't_string': 'test4',
         't_list': ['bar', 'foo'],
-        # FIXME: elements of Enum subclasses returned as strings
-        # 't_enum': MyEnum.ITEM_2,
-        # 't_int_enum': MyIntEnum.ITEM_2,
+        't_enum': MyEnum.ITEM_2,
+        't_int_enum': MyIntEnum.ITEM_2,
         't_datetime': datetime(2018, 1, 1),
         # FIXME: passing in a date object doesn't work...
         # 't_date': date(2018, 1, 1),
@@ -127,6 +125,14 @@ def create_test_querying_table(test_querying_table):
         test_querying_table.drop()
 
 
+@pytest.fixture
+def pool(make_pool, event_loop, metadata, create_test_querying_table):
+    """
+    a pool created after the table, with codecs for its enum types
+    """
+    return event_loop.run_until_complete(make_pool(metadata=metadata))
+
+
 async def test_fetch_list(test_querying_table, connection):
     for sample_item in SAMPLE_DATA:
         query = test_querying_table.insert(sample_item)
@@ -0,0 +1,101 @@
+import pytest
+from sqlalchemy import MetaData
+from sqlalchemy.engine import create_engine
+from sqlalchemy.exc import NoSuchTableError
+
+from asyncpgsa.reflection import reflect
+
+from . import URL
+
+SCHEMA = """
+DROP SCHEMA IF EXISTS reflection_test CASCADE;
+CREATE SCHEMA reflection_test;
+CREATE TYPE reflection_test.color AS ENUM ('red', 'green');
+CREATE TABLE reflection_test.users (
+    id serial PRIMARY KEY,
+    email varchar(100) NOT NULL UNIQUE,
+    color reflection_test.color,
+    tags text[],
+    created timestamptz DEFAULT now()
+);
+COMMENT ON TABLE reflection_test.users IS 'people';
+CREATE TABLE reflection_test.posts (
+    id bigserial PRIMARY KEY,
+    user_id int REFERENCES reflection_test.users (id) ON DELETE CASCADE,
+    score numeric(5, 2) CHECK (score >= 0),
+    body text
+);
+CREATE INDEX posts_user ON reflection_test.posts (user_id, id);
+CREATE TABLE reflection_test.unrelated (id int);
+"""
+
+
+def describe(metadata):
+    tables = {}
+    for table in metadata.tables.values():
+        tables[table.name] = (
+            [(c.name, str(c.type), c.nullable, c.primary_key,
+              str(c.server_default.arg) if c.server_default else None)
+             for c in table.columns],
+            sorted((fk.parent.name, fk.target_fullname)
+                   for fk in table.foreign_keys),
+            sorted((i.name, i.unique, tuple(c.name for c in i.columns))
+                   for i in table.indexes),
+            sorted((type(c).__name__, c.name) for c in table.constraints),
+            table.comment,
+        )
+    return tables
+
+
+async def test_reflect_matches_sqlalchemy(connection, tmpdir):
+    await connection.execute(SCHEMA)
+    try:
+        expected = MetaData()
+        expected.reflect(create_engine(URL), schema='reflection_test')
+
+        metadata = await reflect(connection, schema='reflection_test')
+        assert describe(metadata) == describe(expected)
+        posts = metadata.tables['reflection_test.posts']
+        fk, = posts.foreign_keys
+        assert fk.ondelete == 'CASCADE'
+        assert fk.column is metadata.tables['reflection_test.users'].c.id
+    finally:
+        await connection.execute(
+            'DROP SCHEMA reflection_test CASCADE')
+
+
+async def test_reflect_cache(connection, tmpdir):
+    await connection.execute(SCHEMA)
+    path = str(tmpdir.join('schema.json'))
+    try:
+        metadata = await reflect(connection, schema='reflection_test',
+                                 only=['posts'], cache=path)
+        assert sorted(metadata.tables) == ['reflection_test.posts',
+                                           'reflection_test.users']
+        with pytest.raises(NoSuchTableError):
+            await reflect(connection, schema='reflection_test',
+                          only=['nope'], cache=path)
+
+        queries = []
+        connection = connection._con
+        fetch = connection.fetch
+
+        async def counting_fetch(query, *args, **kwargs):
+            queries.append(query)
+            return await fetch(query, *args, **kwargs)
+
+        connection.fetch = counting_fetch
+        cached = await reflect(connection, schema='reflection_test',
+                               cache=path)
+        assert not queries
+        assert len(cached.tables) == 3
+
+        await connection.execute(
+            'ALTER TABLE reflection_test.unrelated ADD COLUMN name text')
+        changed = await reflect(connection, schema='reflection_test',
+                                cache=path)
+        assert queries
+        assert 'name' in changed.tables['reflection_test.unrelated'].c
+    finally:
+        await connection.execute(
+            'DROP SCHEMA reflection_test CASCADE')
@@ -0,0 +1,46 @@
+import pytest
+from asyncpg import exceptions
+
+from asyncpgsa.retry import RetryStats, backoff_delay, retry
+
+
+def _failing(errors, result='ok'):
+    errors = list(errors)
+
+    async def fn():
+        if errors:
+            raise errors.pop(0)
+        return result
+    return fn
+
+
+def test_backoff_delay():
+    for attempt in range(10):
+        assert 0 <= backoff_delay(attempt, 0.01, 0.05) <= 0.05
+
+
+async def test_retry_until_success():
+    stats = RetryStats()
+    fn = _failing([exceptions.SerializationError('a'),
+                   exceptions.DeadlockDetectedError('b')])
+    assert await retry(fn, retries=2, backoff=0, stats=stats) == 'ok'
+    assert stats.stats() == {
+        'calls': 1,
+        'retries': 2,
+        'failures': 0,
+        'errors': {'SerializationError': 1, 'DeadlockDetectedError': 1},
+    }
+
+
+async def test_retry_gives_up():
+    stats = RetryStats()
+    fn = _failing([exceptions.SerializationError('a')] * 3)
+    with pytest.raises(exceptions.SerializationError):
+        await retry(fn, retries=2, backoff=0, stats=stats)
+    assert stats.failures == 1
+
+
+async def test_retry_ignores_other_errors():
+    fn = _failing([ValueError('a')])
+    with pytest.raises(ValueError):
+        await retry(fn, retries=2, backoff=0)
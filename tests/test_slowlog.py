@@ -0,0 +1,50 @@
+import asyncio
+import logging
+
+from asyncpgsa.deadline import deadline
+from asyncpgsa.slowlog import SlowQueryLog, slow_query_threshold
+
+
+def test_threshold_override():
+    log = SlowQueryLog(threshold=1)
+    assert log.record('SELECT 1', [], 0.5) is None
+    with slow_query_threshold(0.1):
+        slow = log.record('SELECT $1', [1], 0.5)
+    assert slow.param_types == ['int']
+    assert list(log.recent) == [slow]
+
+
+async def test_slow_query_explained_once(make_pool, caplog):
+    pool = await make_pool(slow_query_log=0.05)
+    log = pool.slow_query_log
+    with caplog.at_level(logging.WARNING, logger='asyncpgsa.slow_query'):
+        async with pool.acquire() as con:
+            await con.fetch('SELECT pg_sleep(0.1), $1::int', 1)
+            await con.fetch('SELECT 1')
+            for _ in range(20):
+                if log.plans:
+                    break
+                await asyncio.sleep(0.05)
+            await con.fetch('SELECT pg_sleep(0.1), $1::int', 2)
+
+    first, second = log.recent
+    assert first.duration >= 0.1
+    assert first.param_types == ['int']
+    assert first.plan[0]['Plan']['Node Type'] == 'Result'
+    assert second.plan is first.plan
+    assert len(log.plans) == 1
+    assert sum('plan for slow query' in r.getMessage()
+               for r in caplog.records) == 1
+    assert sum(r.getMessage().startswith('slow query')
+               for r in caplog.records) == 2
+
+
+async def test_explain_ignores_callers_deadline(make_pool):
+    pool = await make_pool(slow_query_log=0.05)
+    log = pool.slow_query_log
+    with deadline(-1):
+        log.record('SELECT $1::int', [1], 1.0)
+    task, = log._tasks
+    await task
+    assert log.plans
+    assert not log._tasks
@@ -0,0 +1,115 @@
+import sqlalchemy as sa
+
+from asyncpgsa.stats import StatementCacheStats, StatementStatsTable
+
+query = sa.select('*') \
+    .select_from(sa.text('sqrt(:num) as a')) \
+    .params(num=16)
+
+
+def test_stats_table():
+    table = StatementStatsTable(max_statements=2, samples=4)
+    for i in range(1, 6):
+        table.record('q1', 0.001, i / 10, rows=2)
+    table.record('q2', 0, 0.01, error=True)
+
+    q1 = table['q1'].snapshot()
+    assert q1['calls'] == 5
+    assert q1['rows'] == 10
+    assert round(q1['compile_time'], 3) == 0.005
+    assert round(q1['max_time'], 3) == 0.501
+    assert round(q1['mean_time'], 3) == 0.301
+    # only the last 4 samples are kept
+    assert round(q1['p50_time'], 3) == 0.401
+    assert table['q2'].errors == 1
+    assert [s['query'] for s in table.snapshot()] == ['q1', 'q2']
+
+    table.record('q3', 0, 0)
+    assert len(table) == 2
+    table.reset()
+    assert len(table) == 0
+
+
+def test_statement_cache_churn_is_not_thrashing():
+    class Connection:
+        pass
+
+    cache_stats = StatementCacheStats(window=10, thrash_rate=0.3)
+    connections = [Connection() for _ in range(5)]
+    # every new connection prepares the same statements once
+    for con in connections:
+        for i in range(3):
+            cache_stats.record('SELECT {}'.format(i), miss=True,
+                               evicted=i == 2, connection=con)
+    assert cache_stats.misses == 15
+    assert not cache_stats.thrashing()
+
+    con = connections[0]
+    for _ in range(2):
+        cache_stats.record('SELECT 3', miss=True, evicted=True,
+                           connection=con)
+    assert cache_stats.thrashing(con)
+    assert cache_stats.thrashing()
+    assert not cache_stats.thrashing(connections[1])
+
+
+async def test_pool_statement_stats(make_pool):
+    pool = await make_pool(statement_stats=True)
+    async with pool.acquire() as con:
+        for _ in range(3):
+            await con.fetch(query)
+        await con.execute('SELECT 1')
+        await con.execute(query)
+
+    stats = pool.statement_stats['SELECT * \nFROM sqrt($1) as a']
+    assert stats.calls == 4
+    assert stats.rows == 4
+    assert stats.compile_time > 0
+    assert stats.execute_time > 0
+    assert pool.statement_stats['SELECT 1'].calls == 1
+
+    compile_time = stats.compile_time
+    async with pool.transaction() as con:
+        async for _ in con.cursor(query):
+            pass
+    # a cursor's rows are streamed, it only adds compile time
+    assert stats.calls == 4
+    assert stats.compile_time > compile_time
+
+
+async def test_chunked_cursor_stats(make_pool):
+    pool = await make_pool(statement_stats=True, pgbouncer_mode=True)
+    async with pool.transaction() as con:
+        for _ in range(2):
+            async for _ in con.cursor(query, prefetch=1):
+                pass
+
+    sql = 'SELECT * \nFROM sqrt($1) as a'
+    queries = [s['query'] for s in pool.statement_stats.snapshot()]
+    assert sql in queries
+    assert not [q for q in queries if 'DECLARE' in q or 'FETCH' in q]
+    # like asyncpg cursors, only the compile time is recorded
+    assert pool.statement_stats[sql].calls == 0
+    assert pool.statement_stats[sql].compile_time > 0
+
+
+async def test_statement_cache_thrash(make_pool):
+    cache_stats = StatementCacheStats(auto_resize=True)
+    pool = await make_pool(statement_cache_stats=cache_stats, min_size=1,
+                           max_size=1, statement_cache_size=2)
+    async with pool.acquire() as con:
+        for _ in range(3):
+            for i in range(3):
+                await con.fetchval('SELECT {}'.format(i))
+
+        snapshot = cache_stats.snapshot()
+        assert snapshot['distinct'] == 3
+        assert snapshot['evictions'] > 0
+        assert snapshot['suggested_size'] == 3
+        assert cache_stats.resizes == 1
+        assert con._con._stmt_cache.get_max_size() == 3
+
+        misses = cache_stats.misses
+        for i in range(3):
+            await con.fetchval('SELECT {}'.format(i))
+        assert cache_stats.misses == misses
@@ -0,0 +1,52 @@
+import pytest
+
+from asyncpgsa import tracing
+
+
+class RecordingHook(tracing.Hook):
+    def __init__(self):
+        self.started = []
+        self.ended = []
+
+    def start(self, name, attributes):
+        self.started.append(name)
+        return name
+
+    def end(self, state, attributes, error):
+        self.ended.append((state, dict(attributes), error))
+
+
+@pytest.fixture
+def hook():
+    hook = RecordingHook()
+    tracing.add_hook(hook)
+    try:
+        yield hook
+    finally:
+        tracing.remove_hook(hook)
+
+
+def test_no_hooks_is_noop():
+    assert tracing.span('a') is tracing._NOOP
+
+
+def test_span_error(hook):
+    error = ValueError()
+    with pytest.raises(ValueError):
+        with tracing.span('a', {'x': 1}) as span:
+            span.set('y', 2)
+            raise error
+    assert hook.ended == [('a', {'x': 1, 'y': 2}, error)]
+
+
+async def test_transaction_spans(pool, hook):
+    async with pool.transaction() as conn:
+        await conn.fetchval('SELECT $1::int', 1)
+
+    assert hook.started[:2] == ['asyncpgsa.transaction', 'asyncpgsa.acquire']
+    statements = [attributes['db.statement']
+                  for name, attributes, _ in hook.ended
+                  if name == 'asyncpgsa.execute']
+    # BEGIN, COMMIT and the reset on release go through execute as well
+    assert statements[:3] == ['BEGIN;', 'SELECT $1::int', 'COMMIT;']
+    assert hook.ended[-1][0] == 'asyncpgsa.transaction'
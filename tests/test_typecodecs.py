@@ -0,0 +1,62 @@
+import enum
+from collections import namedtuple
+
+import sqlalchemy as sa
+
+from asyncpgsa.typecodecs import CompositeType, TypeCodecs
+
+
+class Mood(enum.Enum):
+    happy = 'happy!'
+    sad = 'sad...'
+
+
+Point = namedtuple('Point', 'x y')
+
+metadata = sa.MetaData()
+moods = sa.Table(
+    'typecodecs_moods', metadata,
+    sa.Column('mood', sa.Enum(Mood, name='typecodecs_mood')),
+    sa.Column('history', sa.ARRAY(sa.Enum(Mood, name='typecodecs_mood'))),
+    sa.Column('at', CompositeType('typecodecs_point', Point)),
+    sa.Column('plain', sa.Enum('a', 'b', name='typecodecs_plain')),
+)
+
+SETUP = """
+DROP TABLE IF EXISTS typecodecs_moods;
+DROP TYPE IF EXISTS typecodecs_mood;
+DROP TYPE IF EXISTS typecodecs_point;
+DROP TYPE IF EXISTS typecodecs_plain;
+CREATE TYPE typecodecs_mood AS ENUM ('happy', 'sad');
+CREATE TYPE typecodecs_point AS (x int, y int);
+CREATE TYPE typecodecs_plain AS ENUM ('a', 'b');
+CREATE TABLE typecodecs_moods (mood typecodecs_mood,
+    history typecodecs_mood[], at typecodecs_point, plain typecodecs_plain);
+"""
+
+
+def test_collects_types():
+    codecs = TypeCodecs(metadata)
+    assert sorted(codecs.types) == ['typecodecs_mood', 'typecodecs_point']
+
+
+async def test_enum_and_composite_codecs(make_pool):
+    setup_pool = await make_pool()
+    async with setup_pool.acquire() as conn:
+        await conn.execute(SETUP)
+    try:
+        pool = await make_pool(metadata=metadata, min_size=2)
+        async with pool.acquire() as conn:
+            await conn.execute(moods.insert().values(
+                mood=Mood.sad, history=[Mood.happy, Mood.sad],
+                at=Point(1, 2), plain='b'))
+            row = await conn.fetchrow(moods.select())
+            assert row['mood'] is Mood.sad
+            assert row['history'] == [Mood.happy, Mood.sad]
+            assert row['at'] == Point(1, 2)
+            assert row['plain'] == 'b'
+            assert await conn.fetchval(
+                'SELECT $1::typecodecs_mood', Mood.happy) is Mood.happy
+    finally:
+        async with setup_pool.acquire() as conn:
+            await conn.execute('DROP TABLE typecodecs_moods')
@@ -0,0 +1,48 @@
+import sqlalchemy as sa
+
+from asyncpgsa.warmup import StatementRegistry
+
+numbers = sa.table('numbers', sa.column('n'))
+
+
+def cached(con):
+    return [key[0] for key in con._con._stmt_cache._entries]
+
+
+def test_registry_hot_statements():
+    registry = StatementRegistry(max_statements=3, min_count=2)
+    registry.declare(sa.select([numbers.c.n]))
+    for _ in range(3):
+        registry.record('SELECT 2')
+    registry.record('SELECT 3')
+    for _ in range(2):
+        registry.record('SELECT 4')
+
+    assert registry.hot() == ['SELECT numbers.n \nFROM numbers',
+                              'SELECT 2', 'SELECT 4']
+    registry.forget('SELECT 2')
+    assert registry.hot() == ['SELECT numbers.n \nFROM numbers', 'SELECT 4']
+
+
+def test_registry_persists_learned_statements(tmpdir):
+    path = str(tmpdir.join('statements.json'))
+    registry = StatementRegistry(min_count=2, path=path)
+    registry.record('SELECT 1')
+    registry.record('SELECT 1')
+    registry.record('SELECT 2')
+    registry.save()
+
+    assert StatementRegistry(min_count=2, path=path).hot() == ['SELECT 1']
+
+
+async def test_pool_warms_new_connections(make_pool):
+    registry = StatementRegistry(min_count=1)
+    registry.declare('SELECT 1')
+    registry.declare('SELECT * FROM no_such_table')
+    pool = await make_pool(statement_registry=registry, min_size=1)
+
+    async with pool.acquire() as con:
+        assert 'SELECT 1' in cached(con)
+        await con.fetchval('SELECT $1::int', 2)
+    # the broken statement is dropped instead of failing the connection
+    assert registry.hot() == ['SELECT 1', 'SELECT $1::int']